@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+# APP CONTEXT
+# by Michal Wiraszka
+
+# Everything pygame needs set up before Würd Lürnür can draw or play
+# anything: the mixer, the display window and clock, and the sounds and
+# images loaded from disk. None of it is done when modules are imported; the
+# program creates one context when it starts, and assets are only loaded (and
+# then kept) the first time they're asked for.
+
+import pygame as pg
+
+
+class AppContext:
+    def __init__(self, window_size, caption, mixer_settings):
+        pg.mixer.pre_init(*mixer_settings)
+        pg.mixer.init()
+        pg.init()
+        self.window = pg.display.set_mode(window_size, 0, 32)
+        pg.display.set_caption(caption)
+        self.clock = pg.time.Clock()
+        self._assets = {}  # Asset key -> loaded asset
+
+    def get_asset(self, key, load):
+        # Return asset stored under given key, loading it with passed in
+        # function the first time it's asked for
+        if key not in self._assets:
+            self._assets[key] = load()
+        return self._assets[key]
+
+    def close(self):
+        self._assets.clear()
+        pg.quit()
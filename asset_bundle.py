@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+# ASSET BUNDLE
+# by Michal Wiraszka
+
+# Single file holding Würd Lürnür's word images and pronunciations already
+# decoded, as raw pixels and raw samples, so that loading one is a matter of
+# pointing at part of the file rather than opening, reading and decoding a
+# file of its own. The file starts with a header index of every asset it
+# holds (by the path of the file it was made from; see asset_manifest.py),
+# followed by the assets' data, and is opened as a memory map: images are
+# surfaces over the mapped pixels and sounds are made from the mapped
+# samples, so neither needs decoding. They are still copied once, as the
+# program converts each image to the display's pixel format, and pygame
+# copies the samples of every new sound. Made by
+# bake_assets.py (with --bundle); without it, assets are loaded from their
+# files as usual. A bundle is only used while the bake index it was made from
+# is unchanged, so assets baked again without --bundle are never shadowed by
+# their old pixels and samples.
+
+import json
+import mmap
+import os
+import struct
+
+import pygame as pg
+
+from asset_manifest import BAKE_INDEX_PATH, BAKED_DIR, get_file_hash
+
+BUNDLE_PATH = os.path.join(BAKED_DIR, 'assets.bundle')
+MAGIC = b'WLBUNDLE'
+BUNDLE_VERSION = 2
+# Magic bytes, version and byte length of index, at the start of the file
+HEADER_FORMAT = '<8sII'
+ALIGNMENT = 64  # Data of every asset starts at a multiple of this many bytes
+
+
+class AssetBundle:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            # The map stays open after the file is closed; it's copy-on-write,
+            # so drawing on an image changes a private copy of its pages
+            # rather than the file (or crashing, as a read-only map would)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        header_size = struct.calcsize(HEADER_FORMAT)
+        magic, version, index_size = struct.unpack_from(HEADER_FORMAT,
+                                                        self._map)
+        if (magic != MAGIC) or (version != BUNDLE_VERSION):
+            raise ValueError(f'{path} is not a version {BUNDLE_VERSION} '
+                             'asset bundle.')
+        index = json.loads(
+            self._map[header_size:header_size+index_size].decode('utf-8')
+        )
+        self.bake_index_hash = index['bake_index']  # See get_bake_index_hash
+        # Asset path -> {'offset', 'length'} of its data, plus 'width',
+        # 'height' and 'format' of images, and 'mixer' settings of sounds;
+        # offsets count from the start of the (aligned) data after the index
+        self._index = index['assets']
+        self._data_start = get_aligned(header_size + index_size)
+
+    def __contains__(self, path):
+        return path in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def get_data(self, path):
+        # View of asset's data within the mapped file
+        start = self._data_start + self._index[path]['offset']
+        return memoryview(self._map)[start:start+self._index[path]['length']]
+
+    def get_image(self, path):
+        # Surface over its pixels in the mapped file, without decoding
+        entry = self._index[path]
+        return pg.image.frombuffer(self.get_data(path),
+                                   (entry['width'], entry['height']),
+                                   entry['format'])
+
+    def get_sound(self, path):
+        # Sound made from raw samples, or None if they were saved in another
+        # format than the mixer's current one
+        if list(pg.mixer.get_init()) != self._index[path]['mixer']:
+            return None
+        return pg.mixer.Sound(buffer=self.get_data(path))
+
+
+def open_bundle(path):
+    # Asset bundle at given path, or None if there's none to be used
+    if not os.path.exists(path):
+        return None
+    try:
+        bundle = AssetBundle(path)
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        print(f'{e.__class__.__name__}: asset bundle at {path} ({e}).')
+        return None
+    if bundle.bake_index_hash != get_bake_index_hash():
+        print(f'Asset bundle at {path} is out of date; run bake_assets.py '
+              '--bundle to update it.')
+        return None
+    return bundle
+
+def write_bundle(path, assets, bake_index_hash):
+    # Write passed in dict of asset path -> (data, index entry) as a bundle
+    # made from the bake index with given hash, via a temporary file
+    index = {}
+    offset = 0
+    for asset_path, (data, entry) in assets.items():
+        index[asset_path] = dict(entry, offset=offset, length=len(data))
+        offset = get_aligned(offset + len(data))
+    index_data = json.dumps({'bake_index': bake_index_hash,
+                             'assets': index}).encode('utf-8')
+    data_start = get_aligned(struct.calcsize(HEADER_FORMAT) + len(index_data))
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, BUNDLE_VERSION,
+                            len(index_data)))
+        f.write(index_data)
+        for asset_path, (data, _) in assets.items():
+            f.seek(data_start + index[asset_path]['offset'])
+            f.write(data)
+    os.replace(temp_path, path)
+
+def get_bake_index_hash():
+    # Hash of the bake index, which changes whenever any asset is baked
+    # again or removed; None if nothing has been baked
+    try:
+        return get_file_hash(BAKE_INDEX_PATH)
+    except OSError:
+        return None
+
+def get_aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
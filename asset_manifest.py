@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+# ASSET MANIFEST
+# by Michal Wiraszka
+
+# Index of the word images and pronunciations on disk, so that Würd Lürnür
+# knows which words have them without trying (and mostly failing) to open a
+# file for every card. Each asset directory is listed once, with a single
+# os.scandir, and its files are keyed by normalized word (see get_word_key),
+# so e.g. the card 'Winnebago - Ho-Chunk' finds 'Winnebago - Ho-Chunk.png'
+# however its word was capitalized. Assets baked by bake_assets.py are used
+# over the original files they were made from. The manifest is saved to
+# disk, and a directory is only listed again once its modification time has
+# changed (i.e. once files have been added to, removed from or renamed
+# within it).
+
+# Can also be run as a script to report which words of a database have no
+# image or pronunciation, and which assets belong to no word:
+#   python asset_manifest.py [cards.csv]
+
+import csv
+import hashlib
+import json
+import os
+import sys
+import unicodedata
+
+MANIFEST_VERSION = 2  # Changed whenever the layout of saved manifests changes
+# Kind of asset -> (directory, file extensions) of original and baked assets
+SOURCE_DIRS = {'img': ('word_img', ('.png',)),
+               'pron': ('word_pron', ('.ogg',))}
+BAKED_DIR = 'baked'
+BAKE_INDEX_PATH = os.path.join(BAKED_DIR, 'index.json')  # See bake_assets.py
+BAKED_DIRS = {'img': (os.path.join(BAKED_DIR, 'word_img'), ('.jpg', '.png')),
+              'pron': (os.path.join(BAKED_DIR, 'word_pron'), ('.wav',))}
+# Kind of asset -> directories it's looked for in, in order of preference
+ASSET_DIRS = {kind: [BAKED_DIRS[kind], SOURCE_DIRS[kind]]
+              for kind in SOURCE_DIRS}
+MANIFEST_PATH = '.asset_manifest.json'
+HASH_BLOCK_BYTES = 1024 * 1024  # Bytes of a file hashed at a time
+
+
+class AssetManifest:
+    def __init__(self, asset_dirs, path):
+        self.asset_dirs = asset_dirs
+        self.path = path
+        # Directory -> {'extensions': file extensions listed, 'mtime_ns':
+        # directory's modification time, 'files': {word key: file name}}
+        self._listings = self.read()
+
+        is_changed = False
+        for dir_path, extensions in self.get_dirs():
+            mtime_ns = get_dir_mtime(dir_path)
+            listing = self._listings.get(dir_path)
+            if ((listing is None) or (listing['mtime_ns'] != mtime_ns) or
+                    (listing['extensions'] != list(extensions))):
+                self._listings[dir_path] = {
+                    'extensions': list(extensions),
+                    'mtime_ns': mtime_ns,
+                    'files': scan_dir(dir_path, extensions)
+                }
+                is_changed = True
+        if is_changed:
+            self.write()
+
+    def get_dirs(self):
+        # Every (directory, file extensions) pair of every kind of asset
+        return [dir_entry for dir_entries in self.asset_dirs.values()
+                for dir_entry in dir_entries]
+
+    def read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('version') != MANIFEST_VERSION:
+            return {}
+        return manifest['dirs']
+
+    def write(self):
+        # Saved via a temporary file, so a crash never leaves half a manifest;
+        # listings of directories no longer looked in are dropped
+        dirs = {dir_path: self._listings[dir_path]
+                for dir_path, _ in self.get_dirs()}
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'dirs': dirs}, f)
+        os.replace(temp_path, self.path)
+
+    def get_path(self, kind, word):
+        # Path of word's asset of given kind (e.g. 'img'), or None if missing
+        key = get_word_key(word)
+        for dir_path, _ in self.asset_dirs[kind]:
+            file_name = self._listings[dir_path]['files'].get(key)
+            if file_name is not None:
+                return os.path.join(dir_path, file_name)
+        return None
+
+    def get_coverage(self, words):
+        # For each kind of asset, the passed in words missing one, and the
+        # paths of files that belong to none of the words
+        keys = {get_word_key(word) for word in words}
+        coverage = {}
+        for kind, dir_entries in self.asset_dirs.items():
+            covered = set()
+            unused = []
+            for dir_path, _ in dir_entries:
+                files = self._listings[dir_path]['files']
+                covered.update(files)
+                unused.extend(os.path.join(dir_path, file_name)
+                              for key, file_name in sorted(files.items())
+                              if key not in keys)
+            coverage[kind] = {
+                'missing': [word for word in words
+                            if get_word_key(word) not in covered],
+                'unused': unused
+            }
+        return coverage
+
+
+def get_word_key(word):
+    # Key under which a word's assets are found: case, Unicode composition
+    # and runs of whitespace make no difference
+    return ' '.join(unicodedata.normalize('NFC', word).casefold().split())
+
+def get_dir_mtime(dir_path):
+    # Modification time (in ns) of a directory, or None if it's missing
+    try:
+        return os.stat(dir_path).st_mtime_ns
+    except OSError:
+        return None
+
+def get_file_hash(path):
+    # SHA-1 of a file's contents (used to spot changes, not for security)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def scan_dir(dir_path, extensions):
+    # Word key -> name of every file in directory with one of given
+    # extensions; of files whose words only differ in case (or extension),
+    # the first by name is used
+    files = {}
+    try:
+        with os.scandir(dir_path) as entries:
+            file_names = sorted(entry.name for entry in entries
+                                if entry.is_file() and
+                                entry.name.lower().endswith(tuple(extensions)))
+    except OSError:
+        return files
+    for file_name in file_names:
+        files.setdefault(get_word_key(os.path.splitext(file_name)[0]),
+                         file_name)
+    return files
+
+
+if __name__ == '__main__':
+    database_path = sys.argv[1] if len(sys.argv) > 1 else 'cards.csv'
+    with open(database_path, 'r', newline='', encoding='utf-8-sig') as f:
+        words = [row['Word'] for row in csv.DictReader(f)]
+    manifest = AssetManifest(ASSET_DIRS, MANIFEST_PATH)
+    for kind, gaps in manifest.get_coverage(words).items():
+        dir_path = SOURCE_DIRS[kind][0]
+        print(f'{dir_path}: {len(words) - len(gaps["missing"])} of '
+              f'{len(words)} words covered')
+        for word in gaps['missing']:
+            print(f'  missing: {word}')
+        for path in gaps['unused']:
+            print(f'  unused: {path}')
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+# ASSET PREFETCHER
+# by Michal Wiraszka
+
+# Loads assets (e.g. word images and pronunciations) on a pool of worker
+# threads ahead of them being needed, so that the main loop doesn't stall on
+# file I/O and decoding. Only assets inside the most recently requested
+# 'window' are kept; anything that falls outside of it is dropped.
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AssetPrefetcher:
+    def __init__(self, max_workers):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='prefetch')
+        self._futures = {}  # Asset key -> Future of loaded asset
+        # Number of assets which were / weren't ready by the time requested
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self, loaders):
+        # Replace current window with passed in dict of asset keys and the
+        # functions that load them; loads already queued or done are reused
+        for key in list(self._futures):
+            if key not in loaders:
+                self._futures.pop(key).cancel()
+        for key, loader in loaders.items():
+            if key not in self._futures:
+                self._futures[key] = self._executor.submit(loader)
+
+    def take(self, key, loader):
+        # Return prefetched asset, falling back on loading it synchronously;
+        # any exception raised while loading is re-raised here
+        future = self._futures.get(key)
+        if future is not None and future.done() and not future.cancelled():
+            self.hits += 1
+            return future.result()
+        self.misses += 1
+        if future is not None and not future.cancelled():
+            return future.result()  # Still loading; wait rather than redo it
+        return loader()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._futures.clear()
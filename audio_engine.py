@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+# AUDIO ENGINE
+# by Michal Wiraszka
+
+# Plays Würd Lürnür's word pronunciations. Decoded pronunciations are kept in
+# a size-bounded cache, so saying a word again starts straight away instead
+# of decoding its file again, and files found to be missing are remembered
+# so they're only looked for (and reported) once. Pronunciations play on
+# mixer channels reserved for them: sound effects played with Sound.play()
+# are only ever given the other channels, so they can never cut a word off.
+
+import pygame as pg
+
+from lru_cache import LRUCache
+
+
+class AudioEngine:
+    def __init__(self, voice_channels, max_sounds, max_bytes, max_missing,
+                 volume):
+        # Channels 0 to voice_channels-1 are left out of those which pygame
+        # hands out to sounds played without a channel of their own
+        pg.mixer.set_reserved(voice_channels)
+        self._channels = [pg.mixer.Channel(i) for i in range(voice_channels)]
+        self._sounds = LRUCache(max_sounds, max_bytes, get_sound_bytes)
+        self._missing = LRUCache(max_missing)  # Keys of sounds not found
+        self.volume = volume
+
+    def __contains__(self, key):
+        # Whether sound is already decoded, or known to be missing
+        return (key in self._sounds) or (key in self._missing)
+
+    def get_sound(self, key, load):
+        # Return decoded sound stored under given key, loading it with passed
+        # in function if it isn't cached; None if it can't be loaded
+        if key in self._missing:
+            return None
+        sound = self._sounds.get(key)
+        if sound is None:
+            try:
+                sound = load()
+            except Exception as e:
+                print(f'{e.__class__.__name__}: pronunciation at {key}.')
+                self._missing.put(key, True)
+                return None
+            self._sounds.put(key, sound)
+        return sound
+
+    def pronounce(self, key, load):
+        # Play sound (see get_sound) on a free voice channel, or else on the
+        # first one, cutting off whatever it was playing; returns whether
+        # there was a sound to play
+        sound = self.get_sound(key, load)
+        if sound is None:
+            return False
+        channel = next((channel for channel in self._channels
+                        if not channel.get_busy()), self._channels[0])
+        channel.play(sound)
+        channel.set_volume(self.volume)
+        return True
+
+    def stats(self):
+        return {'sounds': self._sounds.stats(),
+                'missing': len(self._missing)}
+
+
+def get_sound_bytes(sound):
+    # Size of a decoded sound, in the mixer's own format, without copying it
+    frequency, size, channels = pg.mixer.get_init()
+    return round(sound.get_length() * frequency) * (abs(size)//8) * channels
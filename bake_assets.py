@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+# BAKE ASSETS
+# by Michal Wiraszka
+
+# Bakes Würd Lürnür's word images and pronunciations into forms that are
+# quicker to load, in the baked/ directory; the program then uses them over
+# the originals (see asset_manifest.py). Images are scaled down to fit the
+# frame they're shown in and saved without any metadata, as JPEG (which
+# decodes several times faster than PNG) unless they have transparent
+# pixels. Pronunciations are decoded once, here, and saved as uncompressed
+# WAV in the mixer's own sample rate, size and channels, so playing them
+# needs no decoding or converting at all.
+# Files are baked in parallel on a pool of processes; a file is only baked
+# again once its contents (or the bake settings) have changed, so baking can
+# be re-run whenever assets are added or changed. With --bundle, every asset
+# is also packed, already decoded, into a single bundle file (see
+# asset_bundle.py):
+#   python bake_assets.py [--workers N] [--bundle]
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+import wave
+
+import pygame as pg
+
+from asset_bundle import BUNDLE_PATH, get_bake_index_hash, write_bundle
+from asset_manifest import (
+    BAKE_INDEX_PATH,
+    BAKED_DIRS,
+    SOURCE_DIRS,
+    get_file_hash
+)
+from wurd_lurnur import MIXER_SETTINGS, WORD_IMG_SIZE
+
+BAKE_VERSION = 1  # Changed whenever assets are baked any differently
+
+
+def init_worker(mixer_settings):
+    # Sounds are decoded into the mixer's format, but never played, so no
+    # audio device is needed
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    pg.mixer.init(*mixer_settings)
+
+def bake_image(source_path, baked_dir):
+    # Scale image down to fit a square of WORD_IMG_SIZE (keeping its aspect
+    # ratio) and save it; returns path of baked image
+    image = pg.image.load(source_path)
+    width, height = image.get_size()
+    scale = WORD_IMG_SIZE / max(width, height)
+    if scale < 1:
+        image = pg.transform.smoothscale(
+            image, (max(1, round(width*scale)), max(1, round(height*scale)))
+        )
+    extension = '.jpg' if is_opaque(image) else '.png'
+    return save_baked(source_path, baked_dir, extension,
+                      lambda path: pg.image.save(image, path))
+
+def is_opaque(image):
+    return (not (image.get_flags() & pg.SRCALPHA) or
+            (pg.surfarray.array_alpha(image).min() == 255))
+
+def get_image_bytes(image, image_format):
+    # Raw pixels of image; pg.image.tobytes only came in with pygame 2.1.3,
+    # replacing pg.image.tostring, which older versions have instead
+    to_bytes = getattr(pg.image, 'tobytes', None) or pg.image.tostring
+    return to_bytes(image, image_format)
+
+def bake_sound(source_path, baked_dir):
+    # Decode sound into the mixer's format and save it as WAV; returns path
+    # of baked sound
+    sound = pg.mixer.Sound(source_path)
+    frequency, size, channels = pg.mixer.get_init()
+
+    def write_wav(path):
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(channels)
+            f.setsampwidth(abs(size) // 8)
+            f.setframerate(frequency)
+            f.writeframes(sound.get_raw())
+    return save_baked(source_path, baked_dir, '.wav', write_wav)
+
+def save_baked(source_path, baked_dir, extension, save):
+    # Save a baked asset, named after its source, with passed in function via
+    # a temporary file (whose extension tells pygame what format to use)
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    path = os.path.join(baked_dir, stem + extension)
+    temp_path = os.path.join(baked_dir, stem + '.tmp' + extension)
+    save(temp_path)
+    os.replace(temp_path, path)
+    return path
+
+BAKERS = {'img': bake_image, 'pron': bake_sound}  # Kind of asset -> baker
+
+
+def get_bake_settings():
+    # Assets baked with other settings than these are baked again
+    return {'version': BAKE_VERSION, 'img_size': WORD_IMG_SIZE,
+            'mixer': list(MIXER_SETTINGS)}
+
+def read_index():
+    # Source path -> {'hash': hash of source, 'path': path of baked asset}
+    # of every asset baked with the current settings
+    try:
+        with open(BAKE_INDEX_PATH, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if index.get('settings') != get_bake_settings():
+        return {}
+    return index['baked']
+
+def write_index(baked):
+    temp_path = BAKE_INDEX_PATH + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'settings': get_bake_settings(), 'baked': baked}, f,
+                  indent=1)
+    os.replace(temp_path, BAKE_INDEX_PATH)
+
+def list_files(dir_path, extensions):
+    # Paths of files in directory with one of given extensions, by name
+    if not os.path.isdir(dir_path):
+        return []
+    with os.scandir(dir_path) as entries:
+        return sorted(entry.path for entry in entries
+                      if entry.is_file() and
+                      entry.name.lower().endswith(tuple(extensions)))
+
+def get_total_bytes(paths):
+    return sum(os.path.getsize(path) for path in paths)
+
+def bake_assets(workers=None):
+    # Bake every asset that has changed since it was last baked, then remove
+    # baked assets whose source is gone; returns the index of baked assets
+    index = read_index()
+    baked = {}
+    jobs = []  # (kind of asset, source path, hash of source)
+    for kind, (source_dir, extensions) in SOURCE_DIRS.items():
+        os.makedirs(BAKED_DIRS[kind][0], exist_ok=True)
+        for source_path in list_files(source_dir, extensions):
+            source_hash = get_file_hash(source_path)
+            entry = index.get(source_path)
+            if ((entry is not None) and (entry['hash'] == source_hash) and
+                    os.path.exists(entry['path'])):
+                baked[source_path] = entry
+            else:
+                jobs.append((kind, source_path, source_hash))
+    skipped = len(baked)
+
+    failed = 0
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(MIXER_SETTINGS,)) as executor:
+            futures = {
+                executor.submit(BAKERS[kind], source_path,
+                                BAKED_DIRS[kind][0]): (source_path,
+                                                       source_hash)
+                for kind, source_path, source_hash in jobs
+            }
+            for future in as_completed(futures):
+                source_path, source_hash = futures[future]
+                try:
+                    baked[source_path] = {'hash': source_hash,
+                                          'path': future.result()}
+                except Exception as e:
+                    print(f'{e.__class__.__name__}: baking {source_path} '
+                          f'({e}).')
+                    failed += 1
+
+    # Anything else in the baked directories is left over from assets since
+    # removed or baked differently
+    baked_paths = {entry['path'] for entry in baked.values()}
+    removed = 0
+    for baked_dir, extensions in BAKED_DIRS.values():
+        for path in list_files(baked_dir, extensions):
+            if path not in baked_paths:
+                os.remove(path)
+                removed += 1
+    write_index(dict(sorted(baked.items())))
+    print(f'Baked {len(jobs) - failed} assets ({skipped} unchanged, {failed} '
+          f'failed, {removed} removed).')
+    return baked
+
+
+def bundle_assets(baked):
+    # Pack the pixels and samples of every baked asset into a bundle, keyed
+    # by baked asset's path, and stamped with the bake index it was made
+    # from; sounds are decoded by this process' own mixer
+    init_worker(MIXER_SETTINGS)
+    mixer = list(pg.mixer.get_init())
+    assets = {}
+    for source_path, entry in sorted(baked.items()):
+        path = entry['path']
+        if path.endswith(BAKED_DIRS['pron'][1]):
+            assets[path] = (pg.mixer.Sound(path).get_raw(), {'mixer': mixer})
+        else:
+            image = pg.image.load(path)
+            image_format = 'RGB' if is_opaque(image) else 'RGBA'
+            assets[path] = (get_image_bytes(image, image_format), {
+                'width': image.get_width(),
+                'height': image.get_height(),
+                'format': image_format
+            })
+    write_bundle(BUNDLE_PATH, assets, get_bake_index_hash())
+    print(f'Bundled {len(assets)} assets '
+          f'({os.path.getsize(BUNDLE_PATH) // 1024} KB).')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Bake Würd Lürnür assets')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes (default: one per CPU)')
+    parser.add_argument('--bundle', action='store_true',
+                        help='also pack every asset into a single file')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    baked = bake_assets(args.workers)
+    if args.bundle:
+        bundle_assets(baked)
+    for kind, (source_dir, extensions) in SOURCE_DIRS.items():
+        source_paths = list_files(source_dir, extensions)
+        baked_paths = [baked[path]['path'] for path in source_paths
+                       if path in baked]
+        print(f'{source_dir}: {get_total_bytes(source_paths) // 1024} KB -> '
+              f'{BAKED_DIRS[kind][0]}: {get_total_bytes(baked_paths) // 1024}'
+              f' KB')
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+# FRAME TIME BENCHMARK
+# by Michal Wiraszka
+
+# Drives Würd Lürnür headlessly over synthetic decks (built by repeating the
+# cards in cards.csv, with a few sessions' worth of random past results) and
+# reports p50/p99 times and throughput of drawing the card screen, wrapping
+# text, writing results to the database, changing cards and (re)opening the
+# database. Decks are built in a temporary directory, so the real database is
+# never touched. Run from anywhere with:
+#   python benchmarks/bench_frames.py [deck sizes...] [--backend csv|sqlite]
+#                                     [--order rand|chron|alpha|due]
+#                                     [--session-cards N]
+
+import argparse
+import csv
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSET_DIRS = ['img', 'sound', 'word_img', 'word_pron']
+DEFAULT_DECK_SIZES = [1000, 10000, 100000]
+PAST_SESSIONS = 5  # Sessions of random past results in each synthetic deck
+SEED = 0
+
+# Work from a temporary copy of the program's directory (with its asset
+# directories linked in) so relative paths resolve as they usually do
+os.environ['WURD_LURNUR_HEADLESS'] = '1'
+WORK_DIR = tempfile.mkdtemp(prefix='wurd_lurnur_bench_')
+for asset_dir in ASSET_DIRS:
+    os.symlink(os.path.join(ROOT_DIR, asset_dir),
+               os.path.join(WORK_DIR, asset_dir))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(WORK_DIR)
+
+import wurd_lurnur as wl
+from card_repository import CARD_COLUMNS
+from results_store import RESULTS_FIELDS
+
+
+def read_template_cards():
+    # Card columns of every card in the real database
+    path = os.path.join(ROOT_DIR, wl.DATABASE_PATH)
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        columns = [header.index(col_name) for col_name in CARD_COLUMNS]
+        return [[row[i] for i in columns] for row in reader]
+
+def build_deck(card_count, template_cards, rng):
+    # Write a database of given size, and its results, to the working dir
+    for path in (wl.DATABASE_PATH, wl.RESULTS_PATH, wl.JOURNAL_PATH,
+                 wl.SQLITE_DATABASE_PATH):
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(wl.DECK_CACHE_DIR, ignore_errors=True)
+
+    id_index = CARD_COLUMNS.index('Card ID')
+    lurnt_index = CARD_COLUMNS.index('Lurnt')
+    with open(wl.DATABASE_PATH, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(CARD_COLUMNS)
+        for i in range(card_count):
+            row = list(template_cards[i % len(template_cards)])
+            row[id_index] = i + 1
+            row[lurnt_index] = 'yes' if rng.random() < 0.1 else ''
+            writer.writerow(row)
+
+    with open(wl.RESULTS_PATH, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(RESULTS_FIELDS)
+        for session_id in range(1, PAST_SESSIONS+1):
+            timestamp = f'0{session_id}.01.2021 12:00'
+            for card_id in range(1, card_count+1):
+                if rng.random() < 0.5:
+                    writer.writerow([card_id, session_id, timestamp,
+                                     rng.choice(['pass', 'fail', '-'])])
+
+
+def time_call(times, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    times.append(time.perf_counter() - start)
+    return result
+
+def get_percentile(times, percentile):
+    ordered = sorted(times)
+    return ordered[min(len(ordered)-1, int(len(ordered) * percentile/100))]
+
+def report(name, times):
+    print(f'  {name:<18}{get_percentile(times, 50)*1000:11.3f}'
+          f'{get_percentile(times, 99)*1000:11.3f}'
+          f'{len(times)/sum(times):12.0f}')
+
+
+def run_session(backend, order, session_cards, rng):
+    # Open the database, start a Session and go through it as a User would;
+    # returns timings of each benchmarked operation
+    timings = {name: [] for name in (
+        'open database', 'select cards', 'fetch cards', 'start session',
+        'draw card screen', 'wrap text', 'update database', 'change card',
+        'close database', 'reopen database'
+    )}
+    repository = time_call(timings['open database'], wl.open_repository,
+                           backend)
+    unlurnt_df = repository.unlurnt_cards()
+    selected_df = time_call(timings['select cards'],
+                            wl.select_session_cards, unlurnt_df, order,
+                            min(session_cards, len(unlurnt_df)),
+                            np.random.default_rng(SEED),
+                            repository.due_dates())
+    session_df = time_call(timings['fetch cards'], repository.fetch_cards,
+                           selected_df['Card ID'])
+    session = time_call(timings['start session'], wl.Session, session_df,
+                        repository)
+
+    defi_rect = session.rects['defi_frame']
+    while True:
+        card = session.current_card
+        # Draw the card as first shown, then with each panel revealed
+        time_call(timings['draw card screen'], session.draw_card_screen, card)
+        card.show_definition = True
+        time_call(timings['draw card screen'], session.draw_card_screen, card)
+        card.show_image = True
+        time_call(timings['draw card screen'], session.draw_card_screen, card)
+        time_call(timings['wrap text'], card.wrap_text, card.definition,
+                  wl.MEDIUM_FONT, defi_rect.width - 4*wl.PAD,
+                  (defi_rect.left + 2*wl.PAD, defi_rect.top + 2*wl.PAD),
+                  format='definition')
+
+        result = rng.choice(['pass', 'fail', 'skip'])
+        session.update_tallies(result)
+        card.update_result(result, play_sfx=False)
+        time_call(timings['update database'], session.update_database)
+        if session.current_card_index == session.card_count - 1:
+            break
+        time_call(timings['change card'], session.change_card, 'right')
+
+    time_call(timings['close database'], repository.close)
+    # Database was opened from scratch above; now its cache is up to date
+    repository = time_call(timings['reopen database'], wl.open_repository,
+                           backend)
+    repository.close()
+    return timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Würd Lürnür frame times')
+    parser.add_argument('deck_sizes', nargs='*', type=int,
+                        default=DEFAULT_DECK_SIZES,
+                        help='number of cards in each synthetic deck')
+    parser.add_argument('--backend', default='csv', choices=['csv', 'sqlite'],
+                        help='storage backend of the card database')
+    parser.add_argument('--order', default='rand',
+                        choices=['rand', 'chron', 'alpha', 'due'],
+                        help='order of cards in each session')
+    parser.add_argument('--session-cards', type=int, default=100,
+                        help='number of cards gone through in each session')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    template_cards = read_template_cards()
+    wl.init_app()
+    rng = random.Random(SEED)
+    try:
+        for deck_size in args.deck_sizes:
+            build_deck(deck_size, template_cards, rng)
+            timings = run_session(args.backend, args.order,
+                                  args.session_cards, rng)
+            print(f'{deck_size} cards, {args.backend} backend, '
+                  f'{args.session_cards} {args.order} cards per session')
+            print(f'  {"operation":<18}{"p50 ms":>11}{"p99 ms":>11}'
+                  f'{"ops/sec":>12}')
+            for name, times in timings.items():
+                report(name, times)
+    finally:
+        wl._prefetcher.shutdown()
+        os.chdir(ROOT_DIR)
+        shutil.rmtree(WORK_DIR)
+
+if __name__ == '__main__':
+    main()
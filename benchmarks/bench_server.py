@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+# SESSION SERVER LOAD TEST
+# by Michal Wiraszka
+
+# Starts the session server (see session_server.py) over a synthetic deck,
+# built as in bench_frames.py in a temporary directory, so the real database
+# is never touched, then has hundreds of simulated learners go through
+# sessions at once: each opens a connection of its own, starts a session,
+# fetches every card of it and registers a random result for each, as fast as
+# the server answers. Reports p50/p99 latency of every kind of request, and
+# requests/sec served overall. Run from anywhere with:
+#   python benchmarks/bench_server.py [--learners N] [--deck-size N]
+#                                     [--session-cards N]
+#                                     [--backend csv|sqlite]
+#                                     [--order rand|chron|alpha|due]
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+from bench_frames import (
+    ROOT_DIR,
+    SEED,
+    WORK_DIR,
+    build_deck,
+    get_percentile,
+    read_template_cards
+)
+
+HOST = '127.0.0.1'
+SERVER_START_TIMEOUT_S = 120  # Opening a large deck the first time is slow
+
+
+async def request(connection, method, path, body, times):
+    # Send one request on a learner's (keep-alive) connection and return
+    # its JSON response, adding its round trip time to passed in list
+    reader, writer = connection
+    data = b'' if body is None else json.dumps(body).encode('utf-8')
+    start = time.perf_counter()
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: {HOST}\r\n'
+                 f'Content-Type: application/json\r\n'
+                 f'Content-Length: {len(data)}\r\n\r\n'.encode('latin-1')
+                 + data)
+    status_line = await reader.readline()
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    response = json.loads(await reader.readexactly(
+        int(headers['content-length'])
+    ))
+    times.append(time.perf_counter() - start)
+    status = int(status_line.split()[1])
+    if status != 200:
+        raise RuntimeError(f'{method} {path}: {status} {response}')
+    return response
+
+async def run_learner(port, order, session_cards, rng, timings):
+    connection = await asyncio.open_connection(HOST, port)
+    try:
+        session = await request(connection, 'POST', '/sessions',
+                                {'order': order, 'cards': session_cards,
+                                 'seed': rng.randrange(2**32)},
+                                timings['create session'])
+        path = f'/sessions/{session["session"]}'
+        for index in range(session['card_count']):
+            await request(connection, 'GET', f'{path}/cards/{index}', None,
+                          timings['fetch card'])
+            await request(connection, 'POST', f'{path}/cards/{index}/result',
+                          {'result': rng.choice(['pass', 'fail', 'skip'])},
+                          timings['register result'])
+        await request(connection, 'GET', path, None, timings['get stats'])
+        await request(connection, 'DELETE', path, None,
+                      timings['end session'])
+    finally:
+        connection[1].close()
+
+async def run_learners(port, learners, order, session_cards, rng):
+    # Returns timings of each kind of request, and the wall time of the run
+    timings = {name: [] for name in (
+        'create session', 'fetch card', 'register result', 'get stats',
+        'end session'
+    )}
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        run_learner(port, order, session_cards,
+                    random.Random(rng.random()), timings)
+        for _ in range(learners)
+    ))
+    elapsed = time.perf_counter() - start
+    connection = await asyncio.open_connection(HOST, port)
+    server_stats = await request(connection, 'GET', '/stats', None, [])
+    connection[1].close()
+    return timings, elapsed, server_stats
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+def wait_for_server(port, server):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_S
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('Session server exited while starting.')
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('Session server did not start in time.')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Würd Lürnür server load')
+    parser.add_argument('--learners', type=int, default=200,
+                        help='number of learners in sessions at once')
+    parser.add_argument('--deck-size', type=int, default=10000,
+                        help='number of cards in the synthetic deck')
+    parser.add_argument('--session-cards', type=int, default=20,
+                        help='number of cards in each learner\'s session')
+    parser.add_argument('--backend', default='csv', choices=['csv', 'sqlite'],
+                        help='storage backend of the card database')
+    parser.add_argument('--order', default='rand',
+                        choices=['rand', 'chron', 'alpha', 'due'],
+                        help='order of cards in each session')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    rng = random.Random(SEED)
+    server = None
+    try:
+        build_deck(args.deck_size, read_template_cards(), rng)
+        port = get_free_port()
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT_DIR, 'session_server.py'),
+             '--port', str(port), '--backend', args.backend],
+            cwd=WORK_DIR, stdout=subprocess.DEVNULL
+        )
+        wait_for_server(port, server)
+        timings, elapsed, server_stats = asyncio.run(run_learners(
+            port, args.learners, args.order, args.session_cards, rng
+        ))
+
+        request_count = sum(len(times) for times in timings.values())
+        print(f'{args.learners} learners, {args.deck_size} cards, '
+              f'{args.backend} backend, {args.session_cards} {args.order} '
+              'cards per session')
+        print(f'  {"request":<18}{"p50 ms":>11}{"p99 ms":>11}'
+              f'{"count":>12}')
+        for name, times in timings.items():
+            print(f'  {name:<18}{get_percentile(times, 50)*1000:11.3f}'
+                  f'{get_percentile(times, 99)*1000:11.3f}{len(times):12}')
+        print(f'  {request_count} requests in {elapsed:.2f} s: '
+              f'{request_count/elapsed:.0f} requests/sec')
+        print(f'  {server_stats["written_results"]} results written in '
+              f'{server_stats["write_batches"]} batches')
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        os.chdir(ROOT_DIR)
+        shutil.rmtree(WORK_DIR)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+# TEXT LAYOUT MICROBENCHMARK
+# by Michal Wiraszka
+
+# Compares the per-frame cost of drawing a card's context and definition, for
+# every card in the database, three ways: with the old wrap_text path, which
+# estimated line breaks from the average char width and rendered every run
+# as a new Text each frame (kept below as the baseline); with layout_text
+# uncached, i.e. laying out with real font metrics each frame; and with the
+# memoized layout, which only blits cached runs. Run from anywhere with:
+#   python benchmarks/bench_text_layout.py [frames per card]
+
+import os
+import sys
+import time
+
+# Run without opening a window or an audio device
+os.environ['WURD_LURNUR_HEADLESS'] = '1'
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)
+
+import pandas as pd
+
+import wurd_lurnur as wl
+from results_store import new_summary
+
+
+class NoHistory:
+    # Stands in for a card repository; result history isn't benchmarked here
+    def summary(self, card_id):
+        return new_summary()
+
+
+def get_text_blocks():
+    # Context examples and definition of every card in the database, grouped
+    # by card and formatted as on screen: (text, max width, format,
+    # highlight pattern, highlight color, word variations)
+    with open(wl.DATABASE_PATH, 'r') as f:
+        cards_df = pd.read_csv(f)
+    rects = wl.get_all_static_surfaces()[1]
+    context_w = rects['context_frame'].width - 4*wl.PAD
+    defi_w = rects['defi_frame'].width - 4*wl.PAD
+
+    cards_blocks = []
+    for i in range(len(cards_df)):
+        card = wl.Card(cards_df.iloc[i], NoHistory())
+        blocks = [(example, context_w, 'context', card.highlight_pattern,
+                   card.color, card.word_variations)
+                  for example in card.context.split('|')]
+        blocks.append((card.definition, defi_w, 'definition', None, None,
+                       []))
+        cards_blocks.append(blocks)
+    return cards_blocks
+
+def draw_frame(blocks, layout):
+    window = wl.get_window()
+    for (text, max_width, format, highlight_pattern, highlight_color,
+         _) in blocks:
+        runs, _ = layout(text, wl.MEDIUM_FONT, max_width, format,
+                         highlight_pattern, highlight_color)
+        for run_text, font_size, color, x, y in runs:
+            window.blit(
+                wl.get_text_surface(run_text, font_size, color,
+                                    wl.PREFERRED_FONTS),
+                (x, y)
+            )
+
+def draw_old_frame(blocks, layout=None):
+    for (text, max_width, format, _, highlight_color,
+         word_variations) in blocks:
+        old_wrap_text(text, wl.MEDIUM_FONT, max_width, (0, 0), format,
+                      word_variations, highlight_color)
+
+def time_frames(cards_blocks, layout, frames, draw=draw_frame):
+    # Show each card for given number of frames; return mean time per frame
+    for blocks in cards_blocks:
+        draw(blocks, layout)  # Warm up text surface and font caches
+    wl.layout_text.cache_clear()
+    start = time.perf_counter()
+    for blocks in cards_blocks:
+        for _ in range(frames):
+            draw(blocks, layout)
+    return (time.perf_counter() - start) / (frames*len(cards_blocks))
+
+
+# Card.wrap_text, format_context and format_definition as they were before
+# text layout was memoized, only turned into functions of the card's word
+# variations and color, as the baseline of the comparison
+
+def old_format_context(line_text, text_x, text_y, font_size, line_count,
+                       word_variations, highlight_color):
+    x_offset = 0
+    while len(line_text) > 0:
+        cutoff_char = len(line_text)
+        leftmost_word = None
+        for word in word_variations:
+            word_index = line_text.find(word)
+            if (word_index != -1) and (word_index < cutoff_char):
+                leftmost_word = word
+                cutoff_char = word_index
+
+        if cutoff_char > 0:
+            regular_text = wl.Text(line_text[:cutoff_char], font_size)
+            regular_text.x = text_x + x_offset
+            regular_text.y = text_y + (line_count * (font_size+3))
+            regular_text.draw()
+
+            x_offset += regular_text.w - 2*wl.PAD
+            line_text = line_text[cutoff_char:]
+
+        if leftmost_word is not None:
+            highlighted_word = wl.Text(leftmost_word, font_size,
+                                       highlight_color)
+            highlighted_word.x = text_x + x_offset
+            highlighted_word.y = text_y + (line_count * (font_size+3))
+            highlighted_word.draw()
+
+            x_offset += (highlighted_word.w - 2*wl.PAD)
+            line_text = line_text[len(leftmost_word):]
+
+        elif line_text.startswith(' '):
+            line_text = line_text[1:]
+
+def old_format_definition(line_text, text_x, text_y, font_size, line_count):
+    x_offset = 0
+    close_bracket_index = line_text.find(']')
+    ssc_text = wl.Text(line_text[:close_bracket_index+1], font_size-5,
+                       wl.BROWN)
+    ssc_text.x = text_x + x_offset
+    ssc_text.y = text_y + line_count*(font_size+3) - 3
+    ssc_text.draw()
+
+    x_offset += ssc_text.w
+    remaining_text = wl.Text(line_text[close_bracket_index+1:], font_size)
+    remaining_text.x = text_x + x_offset
+    remaining_text.y = text_y + line_count*(font_size+3)
+    remaining_text.draw()
+
+def old_wrap_text(text, font_size, max_width, position, format,
+                  word_variations, highlight_color):
+    full_text = wl.Text(text, font_size)
+    char_limit_per_line = int(len(text) * max_width/full_text.w)
+    line_count = 0
+    text_x, text_y = position
+
+    while len(text) > 0:
+        line_chars = char_limit_per_line
+        if ((format == 'definition') and
+                (text[:line_chars].find('[') != -1) and
+                (text[:line_chars].find(']') != -1)):
+            open_bracket_index = text[:line_chars].find('[')
+            close_bracket_index = text[:line_chars].find(']')
+            ssc_text = text[open_bracket_index : close_bracket_index+1]
+            line_chars += (len(ssc_text) // 3)
+        if len(text) > line_chars:
+            while not text[:line_chars].endswith(' '):
+                line_chars -= 1
+        else:
+            line_chars = len(text)
+        line_text = text[:line_chars]
+
+        if format == 'context':
+            old_format_context(line_text, text_x, text_y, font_size,
+                               line_count, word_variations, highlight_color)
+        elif format == 'definition':
+            open_bracket_index = line_text.find('[')
+            if open_bracket_index == 0:
+                close_bracket_index = line_text.find(']')
+                if close_bracket_index == -1:
+                    text_to_output = wl.Text(line_text, font_size)
+                    text_to_output.x = text_x
+                    text_to_output.y = text_y + line_count*(font_size+3)
+                    text_to_output.draw()
+                else:
+                    next_bracket_index = line_text[1:].find('[')
+                    if next_bracket_index != -1:
+                        next_bracket_index += 1
+                        line_text = line_text[:next_bracket_index]
+                        line_chars = len(line_text)
+                    old_format_definition(line_text, text_x, text_y,
+                                          font_size, line_count)
+            else:
+                if open_bracket_index > 0:
+                    line_text = line_text[:open_bracket_index]
+                    line_chars = len(line_text)
+                normal_text = wl.Text(line_text, font_size)
+                normal_text.x = text_x
+                normal_text.y = text_y + line_count*(font_size+3)
+                normal_text.draw()
+        else:
+            full_line_text = wl.Text(line_text, font_size)
+            full_line_text.x = text_x
+            full_line_text.y = text_y + line_count*(font_size+3)
+            full_line_text.draw()
+
+        text = text[line_chars:]
+        line_count += 1
+    return line_count
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    wl.init_app()
+    cards_blocks = get_text_blocks()
+    old = time_frames(cards_blocks, None, frames, draw=draw_old_frame)
+    uncached = time_frames(cards_blocks, wl.layout_text.__wrapped__, frames)
+    cached = time_frames(cards_blocks, wl.layout_text, frames)
+
+    print(f'{len(cards_blocks)} cards, {frames} frames per card')
+    print(f'Old wrap_text:      {old*1000:8.3f} ms/frame')
+    print(f'Uncached layout:    {uncached*1000:8.3f} ms/frame')
+    print(f'Memoized layout:    {cached*1000:8.3f} ms/frame')
+    print(f'Speed-up vs old:    {old/cached:8.1f}x')
+    print(f'Caching alone:      {uncached/cached:8.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+
+# CARD REPOSITORY
+# by Michal Wiraszka
+
+# Storage backends for Würd Lürnür's card database. Both backends expose the
+# same handful of methods used by the program, so either can be chosen at
+# start-up:
+#   csv    - cards.csv + results.csv, with results journalled between
+#            compactions (default); both are read from a binary cache of
+#            their columns (see deck_cache.py) unless changed since, and
+#            only the columns needed to pick a Session's cards are kept in
+#            memory; results are read from the cache a card at a time
+#   sqlite - a single SQLite database file, with cards keyed by Card ID and
+#            transactional single-row updates; built from the .csv files the
+#            first time it is used
+# Either way, a summary of each card's past results (see results_store.py) is
+# kept up to date on every write, so it can be read without going through
+# the card's whole history.
+
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from deck_cache import DeckCache, TextColumn, TextEncoder
+from results_journal import ResultsJournal
+from results_store import (
+    ResultsStore,
+    is_wide_database,
+    migrate_wide_database,
+    new_summary,
+    summarize_results
+)
+
+CARD_COLUMNS = ['Card ID', 'Card Added', 'Word', 'Word Declensions',
+                'Part of Speech', 'Context', 'Definition', 'Lurnt']
+# Columns of every unlurnt card that are needed to pick the cards of a
+# Session; the full rows are only fetched for the cards picked
+KEY_COLUMNS = ['Card ID', 'Card Added', 'Word']
+# Columns of the database cached as dictionary-encoded text
+TEXT_COLUMNS = ['Card Added', 'Word', 'Word Declensions', 'Part of Speech',
+                'Context', 'Definition']
+CHUNK_ROWS = 10000  # Rows of .csv database read or written at a time
+SQLITE_BATCH_SIZE = 500  # Max number of card IDs in a single query
+
+
+class CsvCardRepository:
+    def __init__(self, database_path, results_path, journal_path,
+                 journal_max_bytes, cache_dir):
+        if is_wide_database(database_path):
+            # Databases from older versions store one column per session
+            migrated = migrate_wide_database(database_path, results_path)
+            print(f'Migrated {migrated} past results to {results_path}.')
+        self.database_path = database_path
+        self.results_path = results_path
+        self.cache = DeckCache(cache_dir)
+
+        # Columns of the database are read from its cache, which is first
+        # (re)built if need be; text columns stay memory-mapped, and are
+        # only decoded for the cards fetched for a Session
+        arrays = self.cache.load('cards', database_path)
+        if arrays is None:
+            arrays = self.build_cards_cache()
+        self.text_columns = {col_name: TextColumn(arrays, col_name)
+                             for col_name in TEXT_COLUMNS}
+        # Only the key columns of each card are kept in memory, plus a
+        # boolean Lurnt column; rows are in the same order as in the file
+        self.cards_df = pd.DataFrame({
+            'Card ID': np.array(arrays['Card ID']),
+            'Card Added': self.text_columns['Card Added'].to_categorical(),
+            'Word': self.text_columns['Word'].to_categorical(),
+            'Lurnt': np.array(arrays['Lurnt'])
+        })
+
+        self.results = self.load_results()
+
+        # Replay any results left in the journal by a previous run that exited
+        # before compacting it, then fold them into the database
+        self.journal = ResultsJournal(journal_path, database_path,
+                                      journal_max_bytes)
+        if self.journal.replay(self.cards_df, self.results):
+            self.compact()
+
+        # Map card IDs to row labels so single cards are updated without
+        # scanning the whole dataframe
+        self._row_labels = dict(zip(self.cards_df['Card ID'],
+                                    self.cards_df.index))
+
+    def read_chunks(self, **read_csv_args):
+        # Yield the database as dataframes of (at most) CHUNK_ROWS rows each
+        with pd.read_csv(self.database_path, chunksize=CHUNK_ROWS,
+                         encoding='utf-8-sig', **read_csv_args) as reader:
+            yield from reader
+
+    def build_cards_cache(self):
+        # Stream the database into a new cache of its columns, and return
+        # the arrays saved
+        card_ids = []
+        lurnt = []
+        encoders = {col_name: TextEncoder() for col_name in TEXT_COLUMNS}
+        for chunk in self.read_chunks(
+                dtype={col_name: str for col_name in TEXT_COLUMNS}):
+            card_ids.append(chunk['Card ID'].to_numpy(dtype=np.int64))
+            lurnt.append((chunk['Lurnt'] == 'yes').to_numpy())
+            for col_name, encoder in encoders.items():
+                encoder.add(chunk[col_name])
+        arrays = {
+            'Card ID': np.concatenate(card_ids or [np.zeros(0, np.int64)]),
+            'Lurnt': np.concatenate(lurnt or [np.zeros(0, bool)])
+        }
+        for col_name, encoder in encoders.items():
+            arrays.update(encoder.get_arrays(col_name))
+        self.cache.save('cards', self.database_path, arrays)
+        return arrays
+
+    def load_results(self, due_dates=None):
+        # Results store reading from the (memory-mapped) cache of the results
+        # file, which is first (re)built if need be
+        arrays = self.cache.load('results', self.results_path)
+        if arrays is None:
+            arrays = self.build_results_cache()
+        return ResultsStore(self.results_path, {
+            'Card ID': arrays['Card ID'],
+            'Session ID': arrays['Session ID'],
+            'Timestamp': TextColumn(arrays, 'Timestamp'),
+            'Result': TextColumn(arrays, 'Result')
+        }, due_dates)
+
+    def build_results_cache(self):
+        # Stream the results file into a new cache of its columns, and
+        # return the arrays saved (or, with no results file yet, empty
+        # arrays, which aren't saved)
+        card_ids = []
+        session_ids = []
+        encoders = {'Timestamp': TextEncoder(), 'Result': TextEncoder()}
+        if os.path.exists(self.results_path):
+            with pd.read_csv(self.results_path, chunksize=CHUNK_ROWS,
+                             dtype=str, keep_default_na=False) as reader:
+                for chunk in reader:
+                    card_ids.append(chunk['Card ID'].astype(np.int64))
+                    session_ids.append(chunk['Session ID'].astype(np.int64))
+                    for col_name, encoder in encoders.items():
+                        encoder.add(chunk[col_name])
+        arrays = get_results_arrays(
+            np.concatenate(card_ids or [np.zeros(0, np.int64)]),
+            np.concatenate(session_ids or [np.zeros(0, np.int64)]),
+            encoders
+        )
+        if os.path.exists(self.results_path):
+            self.cache.save('results', self.results_path, arrays)
+        return arrays
+
+    def save_results_cache(self, columns):
+        # Save given results columns (see ResultsStore.get_columns) as the
+        # cache of the results file
+        if not os.path.exists(self.results_path):
+            return
+        card_ids, session_ids, timestamps, results = columns
+        encoders = {'Timestamp': TextEncoder(), 'Result': TextEncoder()}
+        encoders['Timestamp'].add(timestamps)
+        encoders['Result'].add(results)
+        self.cache.save('results', self.results_path,
+                        get_results_arrays(card_ids, session_ids, encoders))
+
+    def compact(self):
+        # Fold journalled results into the .csv files, then bring their
+        # caches up to date; text columns of the database are copied over
+        # exactly as they were, so only its Lurnt flags are saved again
+        self.journal.compact(self.write_database, self.results)
+        self.cache.save(
+            'cards', self.database_path,
+            {'Lurnt': self.cards_df['Lurnt'].to_numpy()},
+            unchanged=[key for column in self.text_columns.values()
+                       for key in column.keys] + ['Card ID']
+        )
+        # The results store is let go of before its cache is saved again, as
+        # its memory maps of the old cache's files would keep them from being
+        # replaced on Windows. Results recorded so far are then read back
+        # from the new cache, so they needn't be kept in memory any longer;
+        # any due dates worked out still hold
+        columns = self.results.get_columns()
+        due_dates = self.results.due_dates(compute=False)
+        self.results = None
+        try:
+            self.save_results_cache(columns)
+        finally:
+            self.results = self.load_results(due_dates)
+
+    def write_database(self, path):
+        # Write the database to given path, streaming it over from the
+        # current file one chunk at a time with Lurnt flags updated from
+        # memory; everything else is copied over as text, exactly as it was
+        lurnt = np.where(self.cards_df['Lurnt'], 'yes', '')
+        written = 0
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            for chunk in self.read_chunks(dtype=str, keep_default_na=False):
+                chunk['Lurnt'] = lurnt[written:written+len(chunk)]
+                chunk.to_csv(f, index=False, header=(written == 0))
+                written += len(chunk)
+
+    @property
+    def last_session_id(self):
+        return self.results.last_session_id
+
+    def card_count(self):
+        return len(self.cards_df)
+
+    def unlurnt_cards(self):
+        # Key columns only; see fetch_cards
+        return self.cards_df.loc[~self.cards_df['Lurnt'], KEY_COLUMNS]
+
+    def fetch_cards(self, card_ids):
+        # Full rows of given cards, in given order; only these rows' text is
+        # decoded from the cache
+        card_ids = [int(card_id) for card_id in card_ids]
+        rows = np.array([self._row_labels[card_id] for card_id in card_ids],
+                        dtype=np.int64)
+        # Frame is made in one go, as adding columns one by one is slow
+        columns = {'Card ID': np.array(card_ids, dtype=np.int64)}
+        for col_name, column in self.text_columns.items():
+            columns[col_name] = column.decode(rows)
+        columns['Lurnt'] = np.where(
+            self.cards_df['Lurnt'].to_numpy()[rows], 'yes', ''
+        )
+        return pd.DataFrame(columns, columns=CARD_COLUMNS)
+
+    def summary(self, card_id):
+        return self.results.summary(card_id)
+
+    def due_dates(self):
+        return self.results.due_dates()
+
+    def update_card(self, card_id, session_id, timestamp, result, lurnt):
+        self.update_cards([(card_id, session_id, timestamp, result, lurnt)])
+
+    def update_cards(self, updates):
+        # Apply (card ID, session ID, timestamp, result, lurnt) updates in
+        # order, journalling them all with a single write to disk; nothing
+        # is changed in memory unless every card exists and the journal was
+        # written, so memory is never ahead of what's on disk
+        rows = [self._row_labels[card_id] for card_id, *_ in updates]
+        self.journal.append_many(updates)
+        for row, (card_id, session_id, timestamp, result, lurnt) in zip(
+                rows, updates):
+            self.cards_df.at[row, 'Lurnt'] = lurnt
+            self.results.record(card_id, session_id, timestamp, result)
+        if self.journal.needs_compaction():
+            self.compact()
+
+    def close(self):
+        self.compact()
+
+
+class SqliteCardRepository:
+    def __init__(self, path, csv_repository_factory):
+        is_new = not os.path.exists(path)
+        self.connection = sqlite3.connect(path)
+        # Summaries of databases from older versions have no review schedule;
+        # they're dropped here, and then rebuilt below
+        summary_columns = [row[1] for row in self.connection.execute(
+            'PRAGMA table_info(card_summaries)'
+        )]
+        if summary_columns and ('Due' not in summary_columns):
+            self.connection.execute('DROP TABLE card_summaries')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS cards (
+                "Card ID" INTEGER PRIMARY KEY,
+                "Card Added" TEXT,
+                "Word" TEXT,
+                "Word Declensions" TEXT,
+                "Part of Speech" TEXT,
+                "Context" TEXT,
+                "Definition" TEXT,
+                "Lurnt" TEXT NOT NULL DEFAULT ''
+            );
+            CREATE INDEX IF NOT EXISTS cards_lurnt ON cards ("Lurnt");
+            CREATE TABLE IF NOT EXISTS results (
+                "Card ID" INTEGER NOT NULL,
+                "Session ID" INTEGER NOT NULL,
+                "Timestamp" TEXT,
+                "Result" TEXT,
+                PRIMARY KEY ("Card ID", "Session ID")
+            );
+            CREATE INDEX IF NOT EXISTS results_session
+                ON results ("Session ID");
+            CREATE TABLE IF NOT EXISTS card_summaries (
+                "Card ID" INTEGER PRIMARY KEY,
+                "Passes" INTEGER NOT NULL,
+                "Fails" INTEGER NOT NULL,
+                "Last Result" TEXT,
+                "Last Seen" TEXT,
+                "Last Session ID" INTEGER NOT NULL,
+                "Recent Results" TEXT NOT NULL,
+                "Ease" REAL NOT NULL,
+                "Interval" INTEGER NOT NULL,
+                "Repetitions" INTEGER NOT NULL,
+                "Due" TEXT
+            );
+        ''')
+        if is_new:
+            # Import existing cards and results from the .csv backend
+            self.import_from(csv_repository_factory())
+        elif self.needs_summaries():
+            # Databases from older versions may have no card summaries yet
+            self.build_summaries()
+
+    def import_from(self, csv_repository):
+        # Cards are imported one chunk of the .csv database at a time (which
+        # is up to date, as opening it compacts any journalled results)
+        with self.connection:
+            for chunk in csv_repository.read_chunks():
+                cards = []
+                for row in chunk[CARD_COLUMNS].itertuples(index=False):
+                    # Store missing values as NULL, except for the indexed
+                    # Lurnt flag
+                    row = [None if pd.isna(val) else val for val in row]
+                    row[-1] = 'yes' if row[-1] == 'yes' else ''
+                    cards.append(row)
+                self.connection.executemany(
+                    'INSERT INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?)', cards
+                )
+            self.connection.executemany(
+                'INSERT INTO results VALUES (?, ?, ?, ?)',
+                csv_repository.results.rows()
+            )
+        self.build_summaries()
+
+    def needs_summaries(self):
+        has_summaries = self.connection.execute(
+            'SELECT 1 FROM card_summaries LIMIT 1'
+        ).fetchone()
+        has_results = self.connection.execute(
+            'SELECT 1 FROM results LIMIT 1'
+        ).fetchone()
+        return (has_results is not None) and (has_summaries is None)
+
+    def build_summaries(self):
+        # Summarize every card's results in a single pass over them
+        results_by_card = {}
+        for card_id, session_id, timestamp, result in self.connection.execute(
+                'SELECT * FROM results'):
+            results_by_card.setdefault(card_id, {})[session_id] = (
+                timestamp, result
+            )
+        with self.connection:
+            self.connection.execute('DELETE FROM card_summaries')
+            self.connection.executemany(
+                'INSERT INTO card_summaries VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.get_summary_row(card_id, summarize_results(results))
+                 for card_id, results in results_by_card.items())
+            )
+
+    def get_summary_row(self, card_id, summary):
+        # Card's summary as a row of the card_summaries table; its latest
+        # pass/fail results are stored as a JSON list
+        return (card_id, summary['passes'], summary['fails'],
+                summary['last_result'], summary['last_seen'],
+                summary['last_session_id'], json.dumps(summary['recent']),
+                summary['ease'], summary['interval'],
+                summary['repetitions'], summary['due'])
+
+    @property
+    def last_session_id(self):
+        row = self.connection.execute(
+            'SELECT MAX("Session ID") FROM results'
+        ).fetchone()
+        return row[0] or 0
+
+    def card_count(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM cards'
+        ).fetchone()[0]
+
+    def unlurnt_cards(self):
+        # Key columns only; see fetch_cards
+        return pd.read_sql_query(
+            'SELECT "Card ID", "Card Added", "Word" FROM cards '
+            'WHERE "Lurnt" = \'\' ORDER BY "Card ID"', self.connection
+        )
+
+    def fetch_cards(self, card_ids):
+        # Full rows of given cards, in given order
+        card_ids = [int(card_id) for card_id in card_ids]
+        batches = []
+        for start in range(0, len(card_ids), SQLITE_BATCH_SIZE):
+            batch = card_ids[start:start+SQLITE_BATCH_SIZE]
+            batches.append(pd.read_sql_query(
+                'SELECT * FROM cards WHERE "Card ID" IN '
+                f'({", ".join("?" * len(batch))})',
+                self.connection, params=batch
+            ))
+        return order_cards(pd.concat(batches), card_ids)
+
+    def summary(self, card_id):
+        row = self.connection.execute(
+            'SELECT "Passes", "Fails", "Last Result", "Last Seen", '
+            '"Last Session ID", "Recent Results", "Ease", "Interval", '
+            '"Repetitions", "Due" FROM card_summaries WHERE "Card ID" = ?',
+            (card_id,)
+        ).fetchone()
+        if row is None:
+            return new_summary()
+        (passes, fails, last_result, last_seen, last_session_id, recent,
+         ease, interval, repetitions, due) = row
+        return {
+            'passes': passes,
+            'fails': fails,
+            'last_result': last_result,
+            'last_seen': last_seen,
+            'last_session_id': last_session_id,
+            'recent': json.loads(recent),
+            'ease': ease,
+            'interval': interval,
+            'repetitions': repetitions,
+            'due': due
+        }
+
+    def due_dates(self):
+        return dict(self.connection.execute(
+            'SELECT "Card ID", "Due" FROM card_summaries '
+            'WHERE "Due" IS NOT NULL'
+        ))
+
+    def update_card(self, card_id, session_id, timestamp, result, lurnt):
+        self.update_cards([(card_id, session_id, timestamp, result, lurnt)])
+
+    def update_cards(self, updates):
+        # All single-row writes of (card ID, session ID, timestamp, result,
+        # lurnt) updates are committed together, or not at all; each card's
+        # summary is rebuilt from its (indexed) results, which also takes
+        # care of a result changed within the same session
+        with self.connection:
+            for card_id, session_id, timestamp, result, lurnt in updates:
+                self.connection.execute(
+                    'UPDATE cards SET "Lurnt" = ? WHERE "Card ID" = ?',
+                    ('yes' if lurnt else '', card_id)
+                )
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                    (card_id, session_id, timestamp, result)
+                )
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO card_summaries VALUES '
+                    '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    self.get_summary_row(card_id,
+                                         self.summarize_card(card_id))
+                )
+
+    def summarize_card(self, card_id):
+        rows = self.connection.execute(
+            'SELECT "Session ID", "Timestamp", "Result" FROM results '
+            'WHERE "Card ID" = ?', (card_id,)
+        )
+        return summarize_results({session_id: (timestamp, result)
+                                  for session_id, timestamp, result in rows})
+
+    def close(self):
+        self.connection.close()
+
+
+def get_results_arrays(card_ids, session_ids, encoders):
+    # Arrays of a results cache, given the card and session IDs of every
+    # result, and the encoders of their other columns; timestamps and
+    # results (e.g. 'pass') are dictionary-encoded, which takes a single byte
+    # per result, and rows are sorted by card ID, so that the results of a
+    # card can be found by binary search
+    order = np.argsort(card_ids, kind='stable')
+    arrays = {'Card ID': card_ids[order], 'Session ID': session_ids[order]}
+    for col_name, encoder in encoders.items():
+        col_arrays = encoder.get_arrays(col_name)
+        codes_key = f'{col_name}.codes'
+        col_arrays[codes_key] = col_arrays[codes_key][order]
+        arrays.update(col_arrays)
+    return arrays
+
+def order_cards(cards_df, card_ids):
+    # Rows of dataframe of cards reordered to match given list of card IDs
+    cards_df = cards_df.set_index('Card ID', drop=False)
+    return cards_df.loc[card_ids].reset_index(drop=True)
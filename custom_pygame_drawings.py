@@ -6,20 +6,66 @@
 # Contains a series of custom functions built on Pygame's basic drawing
 # functionality. Tailored specifically for use in Würd Lürnür.
 
+import json
+import os
+import sys
+
 import pygame as pg
 import pygame.gfxdraw as gfxdraw
 
+from lru_cache import LRUCache
+
+# Limits on number of fonts and text surfaces (and their estimated total size)
+# kept in memory; least recently used ones are discarded first
+FONT_CACHE_MAX_ENTRIES = 32
+TEXT_CACHE_MAX_ENTRIES = 2048
+TEXT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+OVERLAY_CACHE_MAX_ENTRIES = 64
+# Resolved system font paths are saved here between runs, so that installed
+# fonts only need to be enumerated again once the font directories change
+FONT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               '.font_index.json')
+
+
+class IconAtlas:
+    # Packs a dict of icon surfaces into a single surface, side by side, so
+    # any icon can be drawn by name from its area of that one surface
+    def __init__(self, icons):
+        atlas_w = sum(icon.get_width() for icon in icons.values())
+        atlas_h = max(icon.get_height() for icon in icons.values())
+        self.surface = pg.Surface((atlas_w, atlas_h), pg.SRCALPHA)
+        self.rects = {}
+
+        icon_x = 0
+        for name, icon in icons.items():
+            # Copy icon pixels as they are (an alpha blend onto the fully
+            # transparent atlas would darken any semi-transparent edges)
+            self.surface.blit(icon, (icon_x, 0),
+                              special_flags=pg.BLEND_RGBA_MAX)
+            self.rects[name] = pg.Rect(icon_x, 0, *icon.get_size())
+            icon_x += icon.get_width()
+        if pg.display.get_surface() is not None:
+            self.surface = self.surface.convert_alpha()
+
+    def draw(self, surface, name, position):
+        surface.blit(self.surface, position, self.rects[name])
+
 
 def draw_circle(surface, x_position, y_position, radius, color):
     gfxdraw.aacircle(surface, x_position, y_position, radius, color)
     gfxdraw.filled_circle(surface, x_position, y_position, radius, color)
 
+_cached_overlays = LRUCache(OVERLAY_CACHE_MAX_ENTRIES)
 def dim_rect(surface, rect, color, alpha=64):
     # Draw a partially-transparent surface of given color onto area
-    # defined by passed in rect object
-    surface_to_dim = pg.Surface((rect.width, rect.height))
-    surface_to_dim.set_alpha(alpha)
-    surface_to_dim.fill(color)
+    # defined by passed in rect object; surfaces are reused between calls
+    key = (rect.width, rect.height, tuple(color), alpha)
+    surface_to_dim = _cached_overlays.get(key)
+    if surface_to_dim is None:
+        surface_to_dim = pg.Surface((rect.width, rect.height))
+        surface_to_dim.set_alpha(alpha)
+        surface_to_dim.fill(color)
+        _cached_overlays.put(key, surface_to_dim)
     surface.blit(surface_to_dim, (rect.left, rect.top))
 
 
@@ -70,33 +116,122 @@ def draw_bordered_rounded_rect(surface, rect, fill_color, border_color,
         draw_rounded_rect(surface, inner_rect, fill_color, inner_radius)
 
 
-# Source (slightly modified): www.nerdparadise.com/programming/pygame/part5
+def get_font_dirs():
+    # Directories (and all of their subdirectories) where the platform's
+    # system fonts are installed
+    home = os.path.expanduser('~')
+    if sys.platform == 'darwin':
+        font_dirs = ['/System/Library/Fonts', '/Library/Fonts',
+                     os.path.join(home, 'Library', 'Fonts')]
+    elif sys.platform == 'win32':
+        font_dirs = [
+            os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts'),
+            os.path.join(os.environ.get('LOCALAPPDATA', home), 'Microsoft',
+                         'Windows', 'Fonts')
+        ]
+    else:
+        font_dirs = ['/usr/share/fonts', '/usr/local/share/fonts',
+                     os.path.join(home, '.fonts'),
+                     os.path.join(home, '.local', 'share', 'fonts')]
+
+    # A font added to a subdirectory, however deep, only changes the
+    # modification time of that subdirectory, so every one of them is listed
+    all_dirs = []
+    for font_dir in font_dirs:
+        all_dirs.extend(dir_path for dir_path, _, _ in os.walk(font_dir))
+    return all_dirs
+
+def get_font_dir_mtimes():
+    return {font_dir: os.path.getmtime(font_dir)
+            for font_dir in get_font_dirs()}
+
+_font_index = None
+_font_index_changed = False  # Whether fonts were resolved since last saved
+def get_font_index():
+    # Index of lowercase spaceless font names -> font file paths (or None if
+    # font isn't installed); loaded from disk unless font directories have
+    # changed since it was saved
+    global _font_index
+    if _font_index is None:
+        mtimes = get_font_dir_mtimes()
+        try:
+            with open(FONT_INDEX_PATH, 'r', encoding='utf-8') as f:
+                saved_index = json.load(f)
+            if saved_index['mtimes'] == mtimes:
+                _font_index = saved_index
+        except (OSError, ValueError, KeyError):
+            pass  # Missing or unreadable index is simply rebuilt
+        if _font_index is None:
+            _font_index = {'mtimes': mtimes, 'paths': {}}
+    return _font_index
+
+def save_font_index():
+    # Save the index if any fonts were resolved since it was last saved;
+    # called once fonts have been resolved at startup, rather than on every
+    # font resolved
+    global _font_index_changed
+    if not _font_index_changed:
+        return
+    temp_path = FONT_INDEX_PATH + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(get_font_index(), f)
+        os.replace(temp_path, FONT_INDEX_PATH)
+        _font_index_changed = False
+    except OSError:
+        pass  # Index is only an optimization; carry on without saving it
+
+def resolve_font(name):
+    # Return path of given system font, or None if it isn't installed; only
+    # fonts not yet in the index require Pygame to enumerate system fonts
+    # (see save_font_index for when they're saved)
+    global _font_index_changed
+    paths = get_font_index()['paths']
+    path = paths.get(name)
+    if (name not in paths) or ((path is not None)
+                               and not os.path.exists(path)):
+        path = pg.font.match_font(name)
+        paths[name] = path
+        _font_index_changed = True
+    return path
+
+# Source (heavily modified): www.nerdparadise.com/programming/pygame/part5
 def make_font(fonts, size):
-    # get_fonts() returns a list of lowercase spaceless font names
-    available = pg.font.get_fonts()
+    # Font names are resolved as lowercase spaceless names; first installed
+    # font is used, otherwise Pygame's default font
     choices = map(lambda x: x.lower().replace(' ', ''), fonts)
     for choice in choices:
-        if choice in available:
-            return pg.font.SysFont(choice, size)
+        path = resolve_font(choice)
+        if path is not None:
+            return pg.font.Font(path, size)
     return pg.font.Font(None, size)
 
-_cached_fonts = {}
+_cached_fonts = LRUCache(FONT_CACHE_MAX_ENTRIES)
 def get_font(fonts, size):
-    global _cached_fonts
-    key = str(fonts) + '|' + str(size)
-    font = _cached_fonts.get(key, None)
+    key = (tuple(fonts), size)
+    font = _cached_fonts.get(key)
     if font is None:
         font = make_font(fonts, size)
-        _cached_fonts[key] = font
+        _cached_fonts.put(key, font)
     return font
 
-_cached_text = {}
+def get_surface_size(surface):
+    # Estimated memory used by a surface's pixels, in bytes
+    return surface.get_pitch() * surface.get_height()
+
+_cached_text = LRUCache(TEXT_CACHE_MAX_ENTRIES, TEXT_CACHE_MAX_BYTES,
+                        get_surface_size)
 def get_text_surface(text, size, color, fonts):
-    global _cached_text
-    key = '|'.join(map(str, (fonts, size, color, text)))
-    image = _cached_text.get(key, None)
+    key = (tuple(fonts), size, tuple(color), text)
+    image = _cached_text.get(key)
     if image is None:
         font = get_font(fonts, size)
         image = font.render(text, True, color)
-        _cached_text[key] = image
+        _cached_text.put(key, image)
     return image
+
+def get_cache_stats():
+    # Hit/miss/eviction counters and current size of font, text and overlay
+    # caches
+    return {'fonts': _cached_fonts.stats(), 'text': _cached_text.stats(),
+            'overlays': _cached_overlays.stats()}
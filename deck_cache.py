@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+# DECK CACHE
+# by Michal Wiraszka
+
+# Binary, column-per-file cache of Würd Lürnür's .csv database and results
+# store, so that a large deck can be opened without parsing any .csv at all.
+# Each column is saved as a NumPy .npy file and loaded as a memory map, so
+# only the parts of it actually read are paged in from disk. Text columns are
+# dictionary-encoded: each distinct value is stored once (as UTF-8 bytes,
+# with an array of where each value starts), and every row holds a small
+# integer code for its value, e.g. a single byte per session result.
+# The .csv files stay the source of truth, and can still be edited by hand: a
+# cache is only used while its source file has the same modification time
+# and size as when the cache was saved or, failing that, the same contents.
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from asset_manifest import get_file_hash
+
+CACHE_VERSION = 2  # Changed whenever the layout of cached columns changes
+
+
+class DeckCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def get_path(self, name, key=None):
+        # Path of a cache's manifest or, given a key, of one of its arrays
+        if key is None:
+            return os.path.join(self.cache_dir, f'{name}.json')
+        return os.path.join(self.cache_dir, f'{name}.{key}.npy')
+
+    def load(self, name, source_path):
+        # Dict of key -> memory-mapped array of cache with given name, or None
+        # if there's no such cache or its source file has changed since
+        manifest = self.read_manifest(name)
+        if (manifest is None) or (manifest['version'] != CACHE_VERSION):
+            return None
+        stamp = get_file_stamp(source_path)
+        if stamp is None:
+            return None
+        if stamp != manifest['source_stamp']:
+            # A file that was touched (or copied) without being changed is
+            # only told apart by its contents
+            if ((stamp['size'] != manifest['source_stamp']['size']) or
+                    (get_file_hash(source_path) != manifest['source_hash'])):
+                return None
+            manifest['source_stamp'] = stamp
+            self.write_manifest(name, manifest)
+        try:
+            return {key: np.load(self.get_path(name, key), mmap_mode='r')
+                    for key in manifest['keys']}
+        except (OSError, ValueError):
+            return None
+
+    def save(self, name, source_path, arrays, unchanged=()):
+        # Save passed in dict of key -> array as cache of given source file;
+        # keys listed as unchanged are kept from the cache saved before
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Without a manifest, a crash part-way through leaves no cache rather
+        # than a mix of old and new arrays
+        if os.path.exists(self.get_path(name)):
+            os.remove(self.get_path(name))
+        for key, array in arrays.items():
+            temp_path = self.get_path(name, key) + '.tmp'
+            with open(temp_path, 'wb') as f:
+                np.save(f, np.asarray(array), allow_pickle=False)
+            os.replace(temp_path, self.get_path(name, key))
+        self.write_manifest(name, {
+            'version': CACHE_VERSION,
+            'keys': list(arrays) + list(unchanged),
+            'source_stamp': get_file_stamp(source_path),
+            'source_hash': get_file_hash(source_path)
+        })
+
+    def read_manifest(self, name):
+        try:
+            with open(self.get_path(name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_manifest(self, name, manifest):
+        temp_path = self.get_path(name) + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, self.get_path(name))
+
+
+class TextEncoder:
+    # Dictionary-encodes a column of text given one chunk of values at a
+    # time; missing values (NaN) are given the code -1
+    def __init__(self):
+        self._codes = {}  # Value -> code, in order values were first seen
+        self._code_chunks = []
+
+    def add(self, values):
+        chunk_codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        # Codes of this chunk's values among all values seen; the last entry
+        # is picked by (and keeps) the chunk's missing value code of -1
+        codes = np.array([self._codes.setdefault(value, len(self._codes))
+                          for value in uniques] + [-1], dtype=np.int64)
+        self._code_chunks.append(codes[chunk_codes])
+
+    def get_arrays(self, prefix):
+        # Arrays of encoded column, keyed by given prefix: each row's code,
+        # as the smallest integer type that fits every code, and the UTF-8
+        # bytes and start offsets of its dictionary of values
+        values = [value.encode('utf-8') for value in self._codes]
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(value) for value in values])
+        codes = np.concatenate(self._code_chunks or
+                               [np.zeros(0, dtype=np.int64)])
+        return {
+            f'{prefix}.codes': codes.astype(get_code_dtype(len(values))),
+            f'{prefix}.dictionary': np.frombuffer(b''.join(values),
+                                                  dtype=np.uint8),
+            f'{prefix}.offsets': offsets
+        }
+
+
+class TextColumn:
+    # Dictionary-encoded column of text, as saved by TextEncoder
+    def __init__(self, arrays, prefix):
+        self.keys = [f'{prefix}.codes', f'{prefix}.dictionary',
+                     f'{prefix}.offsets']
+        self.codes, self.dictionary, self.offsets = [arrays[key]
+                                                     for key in self.keys]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def get_values(self):
+        # Every distinct value of the column, in order of their codes
+        data = self.dictionary.tobytes()
+        offsets = self.offsets.tolist()
+        return [data[start:end].decode('utf-8')
+                for start, end in zip(offsets, offsets[1:])]
+
+    def decode(self, rows=None):
+        # Object array of values at given rows (by default, every row), with
+        # NaN for missing values; only the values needed are decoded
+        codes = np.asarray(self.codes if rows is None else self.codes[rows],
+                           dtype=np.int64)
+        values = np.full(len(self.offsets), np.nan, dtype=object)
+        if rows is None:
+            values[:-1] = self.get_values()
+        else:
+            for code in np.unique(codes[codes >= 0]).tolist():
+                start, end = self.offsets[code:code+2].tolist()
+                values[code] = self.dictionary[start:end].tobytes().decode(
+                    'utf-8'
+                )
+        return values[codes]
+
+    def to_categorical(self):
+        # Column as a pandas Categorical, sharing a single copy of each value
+        return pd.Categorical.from_codes(np.asarray(self.codes),
+                                         self.get_values())
+
+
+def get_code_dtype(value_count):
+    # Smallest signed integer type which fits codes of given number of values
+    for dtype in (np.int8, np.int16, np.int32):
+        if value_count <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+def get_file_stamp(path):
+    # Modification time (in ns) and size of a file, or None if it's missing
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+# LRU CACHE
+# by Michal Wiraszka
+
+# Small size-bounded cache which evicts its least recently used entries first;
+# used by Würd Lürnür to keep memory use flat however long a Session runs.
+# Bounded by number of entries and, optionally, by the total estimated size
+# of its values (in bytes) as given by the passed in get_size function.
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, max_entries, max_bytes=None, get_size=None):
+        if max_entries < 1:
+            raise ValueError('Cache must hold at least one entry.')
+        if (max_bytes is not None) and (get_size is None):
+            raise ValueError('Size function needed to limit cache by bytes.')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.get_size = get_size
+        self._entries = OrderedDict()  # Key -> (value, size in bytes)
+        self.total_bytes = 0
+
+        # Usage statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)  # Mark as most recently used
+        return self._entries[key][0]
+
+    def put(self, key, value):
+        if key in self._entries:
+            self.total_bytes -= self._entries.pop(key)[1]
+        size = self.get_size(value) if self.get_size is not None else 0
+        self._entries[key] = (value, size)
+        self.total_bytes += size
+
+        # Always keep the newest entry, even if it's over the limit by itself
+        while len(self._entries) > 1 and (
+                (len(self._entries) > self.max_entries) or
+                ((self.max_bytes is not None) and
+                 (self.total_bytes > self.max_bytes))):
+            self.total_bytes -= self._entries.popitem(last=False)[1][1]
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
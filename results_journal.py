@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# RESULTS JOURNAL
+# by Michal Wiraszka
+
+# Write-ahead journal for Würd Lürnür's card database and results store.
+# Rather than rewriting whole .csv files on every card change, each registered
+# result is appended to the journal as one small record; the journal is
+# compacted back into the database and results store at the end of a Session
+# (or once it grows too large), and replayed on start-up in case the program
+# previously exited without doing so.
+
+import csv
+import os
+
+
+class ResultsJournal:
+    def __init__(self, journal_path, database_path, max_bytes):
+        self.journal_path = journal_path
+        self.database_path = database_path
+        self.max_bytes = max_bytes  # Compaction threshold
+        self._file = None  # Opened lazily on first append
+        self._writer = None
+
+    @property
+    def size(self):
+        if self._file is not None:
+            return self._file.tell()
+        if os.path.exists(self.journal_path):
+            return os.path.getsize(self.journal_path)
+        return 0
+
+    def needs_compaction(self):
+        return self.size >= self.max_bytes
+
+    def append_many(self, records):
+        # Append (card ID, session ID, timestamp, result, lurnt) records and
+        # force them to disk together straight away, so that they survive a
+        # crash; this is the only I/O done on a card change
+        if self._file is None:
+            self._file = open(self.journal_path, 'a', newline='',
+                              encoding='utf-8')
+            self._writer = csv.writer(self._file)
+        self._writer.writerows(
+            [card_id, session_id, timestamp, result, 'yes' if lurnt else '']
+            for card_id, session_id, timestamp, result, lurnt in records
+        )
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def replay(self, cards_df, results):
+        # Apply every journalled record to the passed in dataframe of cards
+        # (its boolean Lurnt column, in place) and results store, and return
+        # the number of records found; later records for the same card and
+        # session override earlier ones
+        if not os.path.exists(self.journal_path):
+            return 0
+        self.drop_partial_record()
+
+        latest = {}
+        with open(self.journal_path, 'r', newline='', encoding='utf-8') as f:
+            for record in csv.reader(f):
+                if len(record) != 5:
+                    continue
+                card_id, session_id, timestamp, result, lurnt = record
+                latest[(int(card_id), int(session_id))] = (
+                    timestamp, result, lurnt
+                )
+
+        # Map card IDs to row labels once instead of scanning per record
+        row_labels = dict(zip(cards_df['Card ID'], cards_df.index))
+        for (card_id, session_id), record in latest.items():
+            if card_id not in row_labels:
+                continue
+            timestamp, result, lurnt = record
+            results.record(card_id, session_id, timestamp, result)
+            cards_df.at[row_labels[card_id], 'Lurnt'] = (lurnt == 'yes')
+        return len(latest)
+
+    def drop_partial_record(self):
+        # A crash mid-write may have left a truncated last record, with no
+        # line ending; cut it off, so that the next record appended starts a
+        # line of its own rather than being joined onto it
+        with open(self.journal_path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                f.truncate(end)
+
+    def compact(self, write_database, results):
+        # Rewrite the database with the passed in function via a temporary
+        # file (so a crash can never leave a half-written database) and save
+        # the results store, then discard the now redundant journal
+        temp_path = self.database_path + '.tmp'
+        write_database(temp_path)
+        os.replace(temp_path, self.database_path)
+        results.save()
+
+        self.close()
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
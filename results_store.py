@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+# RESULTS STORE
+# by Michal Wiraszka
+
+# Long-format ('tidy') store of Würd Lürnür session results: one row of
+# (card ID, session ID, timestamp, result) per registered result, held in a
+# separate .csv file alongside the card database. Results can be read from
+# columns sorted by card, e.g. memory-mapped from a cache (see
+# card_repository.py), in which case a card's results are only read, and
+# its summary (see new_summary) only made, once the card is shown or
+# recorded; only cards with results recorded since are kept in memory, so
+# memory use doesn't grow with the size of the deck or its history.
+
+# Can also be run as a script to migrate an older database, which stored one
+# column per session, to this layout:
+#   python results_store.py [cards.csv] [results.csv]
+
+import csv
+import os
+import sys
+
+import numpy as np
+
+from scheduler import new_schedule, review
+
+RESULTS_FIELDS = ['Card ID', 'Session ID', 'Timestamp', 'Result']
+# First column of an old-style ('wide') database containing session results
+FIRST_SESSION_COL_INDEX = 8
+RECENT_RESULTS_COUNT = 10  # Number of latest pass/fail results in a summary
+
+
+class ResultsStore:
+    def __init__(self, path, columns=None, due_dates=None):
+        # Results are read from the .csv file at given path, unless passed in
+        # as columns: arrays of 'Card ID' (sorted) and 'Session ID', and
+        # 'Timestamp' and 'Result' text columns that can decode given rows
+        # (see deck_cache.TextColumn); these are only ever read from. Due
+        # dates of the same results may be passed in too (see due_dates)
+        self.path = path
+        self._columns = columns
+        self.last_session_id = 0
+        # Card ID -> {Session ID: (timestamp, result)} of every card with a
+        # result recorded since loading (earlier results included), and the
+        # summary of each of those cards
+        self._by_card = {}
+        self._summaries = {}
+        self._due_dates = due_dates  # Card ID -> due date, once needed
+
+        if columns is not None:
+            if len(columns['Session ID']):
+                self.last_session_id = int(np.max(columns['Session ID']))
+        elif os.path.exists(self.path):
+            with open(self.path, 'r', newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    self.record(int(row['Card ID']), int(row['Session ID']),
+                                row['Timestamp'], row['Result'])
+
+    def record(self, card_id, session_id, timestamp, result):
+        # Any result already stored for this card and session is overridden
+        card_results = self._by_card.get(card_id)
+        if card_results is None:
+            card_results = self._by_card[card_id] = self.read_card(card_id)
+        is_override = session_id in card_results
+        card_results[session_id] = (timestamp, result)
+        self.last_session_id = max(self.last_session_id, session_id)
+
+        # Results of a new, latest session are simply added to the summary;
+        # anything else (e.g. a result changed within the same session) has
+        # the card's summary rebuilt from its results
+        summary = self._summaries.get(card_id)
+        if ((summary is None) or is_override or
+                (session_id < summary['last_session_id'])):
+            summary = self._summaries[card_id] = summarize_results(
+                card_results
+            )
+        else:
+            add_to_summary(summary, session_id, timestamp, result)
+        if self._due_dates is not None:
+            if summary['due'] is None:
+                self._due_dates.pop(card_id, None)
+            else:
+                self._due_dates[card_id] = summary['due']
+
+    def read_card(self, card_id):
+        # {Session ID: (timestamp, result)} of card's results in the columns
+        # passed in; found by binary search, as they're sorted by card
+        if self._columns is None:
+            return {}
+        start, end = np.searchsorted(self._columns['Card ID'],
+                                     [card_id, card_id + 1]).tolist()
+        rows = np.arange(start, end)
+        return dict(zip(
+            self._columns['Session ID'][start:end].tolist(),
+            zip(self._columns['Timestamp'].decode(rows).tolist(),
+                self._columns['Result'].decode(rows).tolist())
+        ))
+
+    def get_columns(self):
+        # Every stored result as arrays of card IDs, session IDs, timestamps
+        # and results, sorted by card ID
+        recorded = [(card_id, session_id, timestamp, result)
+                    for card_id, results in self._by_card.items()
+                    for session_id, (timestamp, result) in results.items()]
+        recorded = np.array(recorded, dtype=object).reshape(-1, 4)
+        card_ids = [recorded[:, 0].astype(np.int64)]
+        session_ids = [recorded[:, 1].astype(np.int64)]
+        timestamps = [recorded[:, 2]]
+        results = [recorded[:, 3]]
+        if self._columns is not None:
+            # Results of cards recorded since loading were read in above
+            rows = np.flatnonzero(np.isin(self._columns['Card ID'],
+                                          list(self._by_card), invert=True))
+            card_ids.append(np.asarray(self._columns['Card ID'])[rows])
+            session_ids.append(np.asarray(self._columns['Session ID'])[rows])
+            timestamps.append(self._columns['Timestamp'].decode(rows))
+            results.append(self._columns['Result'].decode(rows))
+
+        card_ids = np.concatenate(card_ids)
+        order = np.argsort(card_ids, kind='stable')
+        return (card_ids[order], np.concatenate(session_ids)[order],
+                np.concatenate(timestamps)[order],
+                np.concatenate(results)[order])
+
+    def rows(self):
+        # Yield every stored result as a (card ID, session ID, timestamp,
+        # result) tuple, by card ID
+        yield from zip(*[column.tolist() for column in self.get_columns()])
+
+    def summary(self, card_id):
+        # Copy of card's summary, unaffected by any results recorded later;
+        # cards with no results recorded since loading are summarized anew
+        summary = self._summaries.get(card_id)
+        if summary is None:
+            return summarize_results(self.read_card(card_id))
+        return dict(summary, recent=list(summary['recent']))
+
+    def due_dates(self, compute=True):
+        # Card ID -> date card is next due for review, for every card with a
+        # pass or fail among its results; worked out from every result the
+        # first time it's needed, then kept up to date (so not to be changed).
+        # Without compute, None unless already worked out
+        if (self._due_dates is None) and compute:
+            self._due_dates = {}
+            if (self._columns is not None) and len(self._columns['Card ID']):
+                card_ids = np.asarray(self._columns['Card ID'])
+                # Rows of each card run from one bound to the next
+                starts = np.flatnonzero(np.diff(card_ids)) + 1
+                bounds = [0] + starts.tolist() + [len(card_ids)]
+                session_ids = self._columns['Session ID'].tolist()
+                timestamps = self._columns['Timestamp'].decode().tolist()
+                results = self._columns['Result'].decode().tolist()
+                for card_id, start, end in zip(
+                        card_ids[bounds[:-1]].tolist(), bounds, bounds[1:]):
+                    if card_id in self._by_card:
+                        continue
+                    due = get_due_date(dict(zip(
+                        session_ids[start:end],
+                        zip(timestamps[start:end], results[start:end])
+                    )))
+                    if due is not None:
+                        self._due_dates[card_id] = due
+            for card_id, summary in self._summaries.items():
+                if summary['due'] is not None:
+                    self._due_dates[card_id] = summary['due']
+        return self._due_dates
+
+    def save(self):
+        # Rewrite the whole store via a temporary file, as with the database
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(RESULTS_FIELDS)
+            writer.writerows(self.rows())
+        os.replace(temp_path, self.path)
+
+
+def new_summary():
+    # Summary of a card's past results: tallies of passes and fails, result
+    # and timestamp of latest session it was shown in (including skips), its
+    # latest pass/fail results as dicts with 'result' and 'timestamp' keys,
+    # and its review schedule (see scheduler.py)
+    return {
+        'passes': 0,
+        'fails': 0,
+        'last_result': None,
+        'last_seen': None,
+        'last_session_id': 0,
+        'recent': [],
+        **new_schedule()
+    }
+
+def add_to_summary(summary, session_id, timestamp, result):
+    # Add (in place) result of a session later than any already summarized
+    summary['last_result'] = result
+    summary['last_seen'] = timestamp
+    summary['last_session_id'] = session_id
+    if result not in ('pass', 'fail'):
+        return
+    summary['passes' if result == 'pass' else 'fails'] += 1
+    summary['recent'].append({'result': result, 'timestamp': timestamp})
+    del summary['recent'][:-RECENT_RESULTS_COUNT]
+    summary.update(review(summary, result, timestamp))
+
+def summarize_results(card_results):
+    # Summarize all results of a card, given as {session ID: (timestamp,
+    # result)}
+    summary = new_summary()
+    for session_id in sorted(card_results):
+        add_to_summary(summary, session_id, *card_results[session_id])
+    return summary
+
+
+def get_due_date(card_results):
+    # Due date of a card given all its results, as {session ID: (timestamp,
+    # result)}; the same as in its summary, without making the rest of it
+    schedule = new_schedule()
+    for session_id in sorted(card_results):
+        timestamp, result = card_results[session_id]
+        if result in ('pass', 'fail'):
+            schedule = review(schedule, result, timestamp)
+    return schedule['due']
+
+
+def is_wide_database(database_path):
+    # Old-style databases have session result columns after the card columns
+    with open(database_path, 'r', newline='', encoding='utf-8-sig') as f:
+        header = next(csv.reader(f))
+    return len(header) > FIRST_SESSION_COL_INDEX
+
+def migrate_wide_database(database_path, results_path):
+    # Move every non-empty session result out of the database's session
+    # columns into a results store, then rewrite the database without them;
+    # returns the number of results migrated
+    with open(database_path, 'r', newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+
+    results = ResultsStore(results_path)
+    session_cols = []
+    for col_index, col_name in enumerate(header):
+        if col_index < FIRST_SESSION_COL_INDEX:
+            continue
+        # Session columns are named e.g. 'Session #3 - 03.01.2021 12:00'; the
+        # last 16 characters are always the timestamp of the session
+        session_id = int(col_name.split('#')[1].split(' -')[0])
+        session_cols.append((col_index, session_id, col_name[-16:]))
+
+    card_id_index = header.index('Card ID')
+    migrated = 0
+    for row in rows:
+        for col_index, session_id, timestamp in session_cols:
+            if col_index < len(row) and row[col_index] != '':
+                results.record(int(row[card_id_index]), session_id, timestamp,
+                               row[col_index])
+                migrated += 1
+    results.save()
+
+    temp_path = database_path + '.tmp'
+    with open(temp_path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(header[:FIRST_SESSION_COL_INDEX])
+        for row in rows:
+            writer.writerow(row[:FIRST_SESSION_COL_INDEX])
+    os.replace(temp_path, database_path)
+    return migrated
+
+
+if __name__ == '__main__':
+    database_path = sys.argv[1] if len(sys.argv) > 1 else 'cards.csv'
+    results_path = sys.argv[2] if len(sys.argv) > 2 else 'results.csv'
+    if not is_wide_database(database_path):
+        print(f'{database_path} has no session columns to migrate.')
+    else:
+        migrated = migrate_wide_database(database_path, results_path)
+        print(f'Migrated {migrated} results from {database_path} '
+              f'to {results_path}.')
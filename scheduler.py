@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# SCHEDULER
+# by Michal Wiraszka
+
+# Spaced-repetition scheduling of Würd Lürnür cards, following the SM-2
+# algorithm: every pass or fail of a card updates its ease factor and the
+# interval (in days) until it's next due for review, so words that are
+# remembered well come up less and less often. A card's schedule is part of
+# its results summary (see results_store.py) and so is always up to date.
+# Due dates are kept as 'YYYY-MM-DD HH:MM' strings, which sort in
+# chronological order as they are.
+
+from datetime import datetime, timedelta
+from functools import lru_cache
+import heapq
+
+TIMESTAMP_FORMAT = '%d.%m.%Y %H:%M'  # Format of session timestamps
+DUE_FORMAT = '%Y-%m-%d %H:%M'
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+# SM-2 grades answers from 0 to 5, with 3 and up being correct; a pass is
+# taken as a correct answer, a fail as an incorrect one that seemed familiar
+GRADES = {'pass': 4, 'fail': 1}
+FIRST_INTERVALS = (1, 6)  # Days until next review after 1st & 2nd pass in row
+DUE_DATE_CACHE_SIZE = 4096  # Max number of (timestamp, interval) due dates
+
+
+class DueQueue:
+    # Priority queue of items (e.g. cards) ordered by their due dates; once
+    # built, which takes O(D) for D items, the N most due items are popped in
+    # O(N log D) without sorting the rest
+    def __init__(self, due_items):
+        # Takes (due date, item) pairs; an item pushed again later replaces
+        # its older entry, which is then skipped when popping
+        self._heap = list(due_items)
+        heapq.heapify(self._heap)
+        self._due_dates = {item: due for due, item in self._heap}
+
+    def __len__(self):
+        return len(self._due_dates)
+
+    def push(self, due, item):
+        self._due_dates[item] = due
+        heapq.heappush(self._heap, (due, item))
+
+    def pop_most_due(self, count):
+        # Remove and return (up to) given number of most due items, most
+        # overdue first
+        items = []
+        while self._heap and len(items) < count:
+            due, item = heapq.heappop(self._heap)
+            if self._due_dates.get(item) == due:
+                del self._due_dates[item]
+                items.append(item)
+        return items
+
+
+def new_schedule():
+    # Schedule of a card that has never been passed or failed
+    return {'ease': INITIAL_EASE, 'interval': 0, 'repetitions': 0,
+            'due': None}
+
+def get_schedule(summary):
+    # Scheduling fields of a card's results summary
+    return {key: summary[key] for key in new_schedule()}
+
+def review(schedule, result, timestamp):
+    # Return new schedule of a card passed or failed at given timestamp (a
+    # session timestamp); a card's due date is left as it was if the
+    # timestamp can't be read
+    grade = GRADES[result]
+    if grade >= 3:
+        repetitions = schedule['repetitions'] + 1
+        if repetitions <= len(FIRST_INTERVALS):
+            interval = FIRST_INTERVALS[repetitions-1]
+        else:
+            interval = round(schedule['interval'] * schedule['ease'])
+    else:
+        # Failed cards start over, being reviewed again the next day
+        repetitions = 0
+        interval = FIRST_INTERVALS[0]
+    ease = max(MIN_EASE,
+               schedule['ease'] + 0.1 - (5-grade) * (0.08 + (5-grade)*0.02))
+
+    due = get_due_date(timestamp, interval)
+    if due is None:
+        due = schedule['due']
+    return {'ease': ease, 'interval': interval, 'repetitions': repetitions,
+            'due': due}
+
+@lru_cache(maxsize=DUE_DATE_CACHE_SIZE)
+def get_due_date(timestamp, interval):
+    # Due date given number of days after a session timestamp, or None if it
+    # can't be read; every card shown in a session shares its timestamp, so
+    # loading all past results only parses each timestamp a few times
+    try:
+        reviewed_at = datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+    except (TypeError, ValueError):
+        return None
+    return (reviewed_at + timedelta(days=interval)).strftime(DUE_FORMAT)
+
+def get_due_now():
+    # Due date of cards that have never been reviewed; these come after any
+    # overdue cards, but before cards not yet due
+    return datetime.now().strftime(DUE_FORMAT)
@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+
+# SESSION SERVER
+# by Michal Wiraszka
+
+# Serves Würd Lürnür sessions to many learners at once, over a small JSON API
+# on localhost, from a single process holding the deck in memory. Sessions
+# pick and order their cards just like the program does (see
+# select_session_cards), and registering a result changes a session's tallies
+# and a card's 'lurnt' state in the same way as clicking a result button.
+# Results of every session are not written as they come in but collected,
+# and written to the database together every WRITE_INTERVAL_S, through the
+# same storage backends the program uses: one append to the journal (or one
+# SQLite transaction) per batch, however many learners there are. Only ever
+# listens on 127.0.0.1. Run with:
+#   python session_server.py [--port N] [--backend csv|sqlite]
+
+# API (requests and responses are JSON):
+#   POST   /sessions                       {"order", "cards", "seed"} (all
+#                                          optional) -> session's stats
+#   GET    /sessions/<id>                  -> session's stats
+#   DELETE /sessions/<id>                  end session -> its final stats
+#   GET    /sessions/<id>/cards/<index>    -> card
+#   POST   /sessions/<id>/cards/<index>/result
+#                                          {"result": "pass"|"fail"|"skip"}
+#                                          -> card and session's stats
+#   GET    /stats                          -> stats of the whole server
+# Sessions left without being ended (e.g. by a learner closing their page)
+# are ended once idle for SESSION_IDLE_TIMEOUT_S.
+
+import argparse
+import asyncio
+import json
+import signal
+import time
+
+import numpy as np
+
+from scheduler import get_schedule
+from wurd_lurnur import (
+    LURNT_INTERVAL_DAYS,
+    LURNT_PASSES,
+    PARTS_OF_SPEECH,
+    get_timestamp_now,
+    is_lurnt_result,
+    open_repository,
+    select_session_cards
+)
+
+HOST = '127.0.0.1'  # Learners connect from this machine only
+DEFAULT_PORT = 8765
+ORDERS = ['rand', 'chron', 'alpha', 'due']
+RESULTS = ['pass', 'fail', 'skip']
+MAX_SESSION_CARDS = 500
+WRITE_INTERVAL_S = 0.05  # Time results are collected for before writing
+# Batches are journalled on the server's own thread, so compacting (which
+# rewrites the whole database) is put off for longer than in the program
+JOURNAL_MAX_BYTES = 8 * 1024 * 1024
+KEEP_ALIVE_TIMEOUT_S = 30  # Idle connections are closed after this long
+SESSION_IDLE_TIMEOUT_S = 30 * 60  # Idle sessions are ended after this long
+SESSION_SWEEP_INTERVAL_S = 60  # Time between looking for idle sessions
+MAX_HEADER_LINES = 100
+MAX_BODY_BYTES = 64 * 1024
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class LearnerSession:
+    def __init__(self, index, session_df, repository, lurnt_passes,
+                 lurnt_interval):
+        self.index = index
+        self.timestamp = get_timestamp_now()
+        self.cards_df = session_df  # Full rows of this session's cards only
+        self.repository = repository
+        self.lurnt_passes = lurnt_passes
+        self.lurnt_interval = lurnt_interval
+
+        self.card_count = len(self.cards_df.index)
+        self.pass_count = 0
+        self.fail_count = 0
+        self.skip_count = 0
+        self.lurnt_count = 0
+        self.cards = [None] * self.card_count  # Created once first fetched
+        self.last_access = time.monotonic()
+
+    def get_card(self, index):
+        if not 0 <= index < self.card_count:
+            raise HttpError(404, f'Session {self.index} has no card {index}.')
+        if self.cards[index] is None:
+            self.cards[index] = LearnerCard(self.cards_df.iloc[index],
+                                            self.repository,
+                                            self.lurnt_passes,
+                                            self.lurnt_interval)
+        return self.cards[index]
+
+    def update_tallies(self, card, change_to):
+        # As with Session.update_tallies: subtract from the card's previous
+        # result before adding to new result tally
+        change_from = card.result
+        if change_from == 'skip':
+            self.skip_count -= 1
+        elif change_from == 'pass':
+            self.pass_count -= 1
+            if card.lurnt:
+                self.lurnt_count -= 1
+        elif change_from == 'fail':
+            self.fail_count -= 1
+
+        if change_to == 'skip':
+            self.skip_count += 1
+        elif change_to == 'pass':
+            self.pass_count += 1
+            if card.would_be_lurnt('pass'):
+                self.lurnt_count += 1
+        elif change_to == 'fail':
+            self.fail_count += 1
+
+    def get_stats(self):
+        return {
+            'session': self.index,
+            'timestamp': self.timestamp,
+            'card_count': self.card_count,
+            'pass_count': self.pass_count,
+            'fail_count': self.fail_count,
+            'skip_count': self.skip_count,
+            'lurnt_count': self.lurnt_count
+        }
+
+
+class LearnerCard:
+    def __init__(self, card_data, repository, lurnt_passes, lurnt_interval):
+        # Card's text is sent in full; it's up to learners' screens how much
+        # of it fits
+        self.id = int(card_data.get('Card ID'))
+        self.data = {
+            'id': self.id,
+            'word': card_data.get('Word'),
+            'declensions': card_data.get('Word Declensions'),
+            'part_of_speech': card_data.get('Part of Speech'),
+            'context': card_data.get('Context'),
+            'definition': card_data.get('Definition')
+        }
+        pos = PARTS_OF_SPEECH.get(str(self.data['part_of_speech']).lower())
+        if pos is not None:
+            self.data['part_of_speech'] = pos['full name']
+        if not isinstance(self.data['declensions'], str):
+            self.data['declensions'] = None  # Empty cells are read as NaN
+
+        summary = repository.summary(self.id)
+        self.result_history = summary['recent']
+        self.passes_count = summary['passes']
+        self.schedule = get_schedule(summary)
+        self.lurnt_passes = lurnt_passes
+        self.lurnt_interval = lurnt_interval
+        self.result = None
+        self.lurnt = False  # Must be false since lurnt words were excluded
+
+    def update_result(self, new_result):
+        self.result = new_result
+        self.lurnt = self.would_be_lurnt(self.result)
+
+    def would_be_lurnt(self, result):
+        return is_lurnt_result(result, self.passes_count, self.schedule,
+                               self.lurnt_passes, self.lurnt_interval)
+
+    def to_json(self):
+        return dict(self.data, history=self.result_history,
+                    due=self.schedule['due'], result=self.result,
+                    lurnt=self.lurnt)
+
+
+class WriteBatcher:
+    def __init__(self, repository, interval_s):
+        self.repository = repository
+        self.interval_s = interval_s
+        # (Card ID, session ID) -> latest update of that card in that
+        # session; a result changed before it's written is only written once
+        self._pending = {}
+        self.batch_count = 0
+        self.write_count = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, card_id, session_id, timestamp, result, lurnt):
+        key = (card_id, session_id)
+        self._pending.pop(key, None)  # Updates are written in order of last
+        self._pending[key] = (card_id, session_id, timestamp, result, lurnt)
+
+    async def run(self):
+        # A failed write is reported and tried again with the next batch
+        while True:
+            await asyncio.sleep(self.interval_s)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f'{e.__class__.__name__}: writing {len(self)} results '
+                      f'({e}).', flush=True)
+
+    def flush(self):
+        # Write every pending update; the repository is only ever used from
+        # the server's one thread, so requests wait while this happens.
+        # Updates stay pending until written, so none are lost if it fails
+        if not self._pending:
+            return
+        updates = list(self._pending.values())
+        self.repository.update_cards(updates)
+        self._pending.clear()
+        self.batch_count += 1
+        self.write_count += len(updates)
+
+
+class SessionServer:
+    def __init__(self, repository, lurnt_passes=LURNT_PASSES,
+                 lurnt_interval=LURNT_INTERVAL_DAYS):
+        self.repository = repository
+        self.lurnt_passes = lurnt_passes
+        self.lurnt_interval = lurnt_interval
+        self.sessions = {}  # Session ID -> LearnerSession
+        # Session IDs are handed out here, as results of a session are only
+        # written to the database once its first result is
+        self.next_session_id = self.repository.last_session_id + 1
+        self.writes = WriteBatcher(repository, WRITE_INTERVAL_S)
+        self._unlurnt_df = None  # Key columns of unlurnt cards; see below
+        self.request_count = 0
+        self.evicted_count = 0
+        self.start_time = time.monotonic()
+
+    async def handle_connection(self, reader, writer):
+        # Serve requests on one connection until the learner closes it (or
+        # it's idle for too long); HTTP/1.1 keeps connections open by default
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader),
+                                                     KEEP_ALIVE_TIMEOUT_S)
+                except HttpError as e:
+                    await write_response(writer, e.status,
+                                         {'error': str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, body, keep_alive = request
+                try:
+                    status, response = 200, self.route(method, path, body)
+                except HttpError as e:
+                    status, response = e.status, {'error': str(e)}
+                except Exception as e:
+                    print(f'{e.__class__.__name__}: {method} {path} ({e}).')
+                    status, response = 500, {'error': 'Internal error.'}
+                self.request_count += 1
+                await write_response(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError,
+                asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def route(self, method, path, body):
+        parts = path.split('?')[0].strip('/').split('/')
+        if parts == ['stats']:
+            check_method(method, ['GET'])
+            return self.get_stats()
+        if parts[0] != 'sessions':
+            raise HttpError(404, f'No such resource: {path}')
+        if len(parts) == 1:
+            check_method(method, ['POST'])
+            return self.create_session(body)
+
+        session = self.get_session(parts[1])
+        if len(parts) == 2:
+            check_method(method, ['GET', 'DELETE'])
+            if method == 'DELETE':
+                return self.end_session(session)
+            return session.get_stats()
+        if (len(parts) in (4, 5)) and (parts[2] == 'cards'):
+            card = session.get_card(parse_int(parts[3], 'card index'))
+            if len(parts) == 4:
+                check_method(method, ['GET'])
+                return card.to_json()
+            if parts[4] == 'result':
+                check_method(method, ['POST'])
+                return self.register_result(session, card, body)
+        raise HttpError(404, f'No such resource: {path}')
+
+    def create_session(self, body):
+        order = body.get('order', 'rand')
+        if order not in ORDERS:
+            raise HttpError(400, f'Order must be one of {ORDERS}.')
+        unlurnt_df = self.get_unlurnt_cards()
+        if len(unlurnt_df) == 0:
+            raise HttpError(409, 'All words in database are lürnt.')
+        card_count = body.get('cards', min(len(unlurnt_df),
+                                           MAX_SESSION_CARDS))
+        if ((type(card_count) != int) or
+                not 1 <= card_count <= MAX_SESSION_CARDS):
+            raise HttpError(400, 'Cards must be a number from 1 to '
+                                 f'{MAX_SESSION_CARDS}.')
+        seed = body.get('seed')
+        if (seed is not None) and (type(seed) != int):
+            raise HttpError(400, 'Seed must be a number.')
+
+        due_dates = self.repository.due_dates() if order == 'due' else None
+        selected_df = select_session_cards(
+            unlurnt_df, order, min(card_count, len(unlurnt_df)),
+            np.random.default_rng(seed), due_dates
+        )
+        session = LearnerSession(
+            self.next_session_id,
+            self.repository.fetch_cards(selected_df['Card ID']),
+            self.repository, self.lurnt_passes, self.lurnt_interval
+        )
+        self.sessions[session.index] = session
+        self.next_session_id += 1
+        return session.get_stats()
+
+    def get_unlurnt_cards(self):
+        # Every change to which cards are lurnt is made through the server,
+        # so unlurnt cards are only read again after such a change
+        if self._unlurnt_df is None:
+            self.writes.flush()
+            self._unlurnt_df = self.repository.unlurnt_cards()
+        return self._unlurnt_df
+
+    def get_session(self, session_id):
+        session = self.sessions.get(parse_int(session_id, 'session ID'))
+        if session is None:
+            raise HttpError(404, f'No open session {session_id}.')
+        session.last_access = time.monotonic()
+        return session
+
+    def register_result(self, session, card, body):
+        # Only update result if it has changed, as the program does
+        result = body.get('result')
+        if result not in RESULTS:
+            raise HttpError(400, f'Result must be one of {RESULTS}.')
+        if result != card.result:
+            was_lurnt = card.lurnt
+            session.update_tallies(card, result)
+            card.update_result(result)
+            if card.lurnt != was_lurnt:
+                self._unlurnt_df = None
+            self.writes.add(card.id, session.index, session.timestamp,
+                            '-' if result == 'skip' else result, card.lurnt)
+        return {'card': card.to_json(), 'stats': session.get_stats()}
+
+    def end_session(self, session):
+        # Session's results are written before it's forgotten
+        self.writes.flush()
+        del self.sessions[session.index]
+        return session.get_stats()
+
+    async def run_evictions(self):
+        while True:
+            await asyncio.sleep(SESSION_SWEEP_INTERVAL_S)
+            try:
+                self.evict_idle_sessions()
+            except Exception as e:
+                print(f'{e.__class__.__name__}: ending idle sessions ({e}).',
+                      flush=True)
+
+    def evict_idle_sessions(self):
+        # End every session not used for SESSION_IDLE_TIMEOUT_S, writing
+        # pending results first (sessions stay open if that fails)
+        deadline = time.monotonic() - SESSION_IDLE_TIMEOUT_S
+        idle = [session_id for session_id, session in self.sessions.items()
+                if session.last_access < deadline]
+        if not idle:
+            return
+        self.writes.flush()
+        for session_id in idle:
+            del self.sessions[session_id]
+        self.evicted_count += len(idle)
+
+    def get_stats(self):
+        return {
+            'uptime_s': round(time.monotonic() - self.start_time, 3),
+            'requests': self.request_count,
+            'open_sessions': len(self.sessions),
+            'evicted_sessions': self.evicted_count,
+            'db_total_card_count': self.repository.card_count(),
+            'pending_writes': len(self.writes),
+            'written_results': self.writes.write_count,
+            'write_batches': self.writes.batch_count
+        }
+
+
+async def read_request(reader):
+    # Read one request; returns (method, path, JSON body as a dict, whether
+    # to keep the connection open), or None once the connection is closed
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, path, version = request_line.decode('latin-1').split()
+    except ValueError:
+        raise HttpError(400, 'Malformed request line.')
+
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HttpError(400, 'Too many headers.')
+
+    body_size = parse_int(headers.get('content-length', '0'),
+                          'Content-Length', 400)
+    if body_size > MAX_BODY_BYTES:
+        raise HttpError(413, 'Request body too large.')
+    body = {}
+    if body_size:
+        try:
+            body = json.loads(await reader.readexactly(body_size))
+        except ValueError:
+            raise HttpError(400, 'Request body is not valid JSON.')
+        if not isinstance(body, dict):
+            raise HttpError(400, 'Request body must be a JSON object.')
+
+    connection = headers.get('connection', '').lower()
+    keep_alive = ((connection != 'close') if version == 'HTTP/1.1'
+                  else (connection == 'keep-alive'))
+    return method.upper(), path, body, keep_alive
+
+async def write_response(writer, status, response, keep_alive):
+    body = json.dumps(response, ensure_ascii=False).encode('utf-8')
+    head = (f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+            'Content-Type: application/json; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+
+def check_method(method, allowed):
+    if method not in allowed:
+        raise HttpError(405, f'Method must be one of {allowed}.')
+
+def parse_int(text, name, status=404):
+    try:
+        return int(text)
+    except ValueError:
+        raise HttpError(status, f'Invalid {name}: {text}')
+
+
+async def serve(port, backend, lurnt_passes, lurnt_interval):
+    repository = open_repository(backend, JOURNAL_MAX_BYTES)
+    server = SessionServer(repository, lurnt_passes, lurnt_interval)
+    listener = await asyncio.start_server(server.handle_connection, HOST,
+                                          port)
+    writes_task = asyncio.create_task(server.writes.run())
+    evictions_task = asyncio.create_task(server.run_evictions())
+
+    # Stop (writing any pending results) on Ctrl+C or when terminated
+    stop = asyncio.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal_number,
+                                                          stop.set)
+        except (NotImplementedError, AttributeError):
+            pass  # Unsupported on Windows; Ctrl+C still stops serve()
+    print(f'Serving Würd Lürnür sessions on http://{HOST}:{port}/ '
+          f'({repository.card_count()} cards).', flush=True)
+    try:
+        await stop.wait()
+    finally:
+        listener.close()
+        writes_task.cancel()
+        evictions_task.cancel()
+        try:
+            server.writes.flush()
+        finally:
+            repository.close()
+        print(f'Wrote {server.writes.write_count} results in '
+              f'{server.writes.batch_count} batches.', flush=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Würd Lürnür session server')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'port to listen on at {HOST}')
+    parser.add_argument('--backend', default='csv', choices=['csv', 'sqlite'],
+                        help='storage backend of the card database')
+    parser.add_argument('--lurnt-passes', type=int, default=LURNT_PASSES,
+                        help='total passes after which a card is lürnt')
+    parser.add_argument('--lurnt-interval', type=int,
+                        default=LURNT_INTERVAL_DAYS,
+                        help='review interval (days) after which a card is '
+                             'lürnt, if reached before enough passes')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    try:
+        asyncio.run(serve(args.port, args.backend, args.lurnt_passes,
+                          args.lurnt_interval))
+    except KeyboardInterrupt:
+        pass
@@ -11,18 +11,31 @@
 # pos = part of speech;  prev = previous; pron = pronunciation;
 # ssc = superscript; val = value
 
+import argparse
 from datetime import datetime
-from random import sample
+from functools import lru_cache
+import os
+import re
 import sys
 
-import pandas as pd
+import numpy as np
 import pygame as pg
 
+from app_context import AppContext
+from asset_bundle import BUNDLE_PATH, open_bundle
+from asset_manifest import ASSET_DIRS, MANIFEST_PATH, AssetManifest
+from asset_prefetcher import AssetPrefetcher
+from audio_engine import AudioEngine
 from custom_pygame_drawings import (
+    IconAtlas,
     dim_rect,
     draw_bordered_rounded_rect,
-    get_text_surface
+    get_font,
+    get_text_surface,
+    save_font_index
 )
+from lru_cache import LRUCache
+from scheduler import DueQueue, get_due_now, get_schedule, review
 
 
 BLACK = (10,10,10)
@@ -44,8 +57,34 @@ YELLOW = (196,185,24)
 # Limit amount of characters in text to be displayed
 MAX_CONTEXT_CHARS = 140
 MAX_DEF_CHARS = 300
-# First column in database containing session results
-FIRST_SESSION_COL_INDEX = 8
+LINE_SPACING = 3  # Extra space between lines of wrapped text
+TEXT_LAYOUT_CACHE_SIZE = 256  # Max number of laid out blocks of text kept
+
+DATABASE_PATH = 'cards.csv'
+RESULTS_PATH = 'results.csv'  # Results of every session, one row per result
+# Results are appended here on every card change and only compacted into the
+# database at the end of a Session, or once the journal exceeds this size
+JOURNAL_PATH = 'cards_journal.csv'
+JOURNAL_MAX_BYTES = 64 * 1024
+SQLITE_DATABASE_PATH = 'cards.db'  # Only used with the 'sqlite' backend
+# Binary cache of the .csv database and results, rebuilt whenever they change
+DECK_CACHE_DIR = '.deck_cache'
+CARD_ADDED_FORMAT = '%d.%m.%Y %H:%M'  # Format of cards' 'Card Added' dates
+# A card is lürnt once it has been passed this many times in total or, if an
+# interval is given, once passing it puts its next review at least that many
+# days away (see scheduler.py); both can be changed on the command line
+LURNT_PASSES = 5
+LURNT_INTERVAL_DAYS = None
+
+# Headless mode (set WURD_LURNUR_HEADLESS=1) runs the program on SDL's dummy
+# video and audio drivers, so it can be driven without a display or sound
+# card, e.g. by the benchmarks; pop-ups are drawn but not held on screen
+HEADLESS = os.environ.get('WURD_LURNUR_HEADLESS', '') not in ('', '0')
+if HEADLESS:
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+UPDATING_POPUP_MS = 0 if HEADLESS else 500
+LURNT_POPUP_MS = 0 if HEADLESS else 2000
 
 TINY_FONT = 12
 SMALL_FONT = 14
@@ -65,47 +104,58 @@ PARTS_OF_SPEECH = {
     '': {'full name': 'unspecified', 'color': WHITE}
 }
 
-# All sound-related pygame loading and initializing
-pg.mixer.pre_init(44100, -16, 2, 4096)
-pg.mixer.init()
-
-NEW_SESSION_SFX = pg.mixer.Sound('sound/new_session.ogg')
-CARD_FLIP_SFX = pg.mixer.Sound('sound/card_flip.ogg')
-TOGGLE_SFX = pg.mixer.Sound('sound/toggle.ogg')
-APPEAR_SFX = pg.mixer.Sound('sound/appear.ogg')
-LURNT_SFX = pg.mixer.Sound('sound/lurnt.ogg')
-POP_SFX = pg.mixer.Sound('sound/popup.ogg')
-QUIT_SFX = pg.mixer.Sound('sound/quit.ogg')
-NEW_SESSION_SFX.set_volume(0.9)
-CARD_FLIP_SFX.set_volume(0.2)
-TOGGLE_SFX.set_volume(0.05)
-APPEAR_SFX.set_volume(0.2)
-LURNT_SFX.set_volume(0.1)
-POP_SFX.set_volume(0.2)
-QUIT_SFX.set_volume(0.2)
-
-# All graphics-related pygame loading and initializing
-pg.init()
+# Pygame is only initialized, and sounds and images only loaded, once the
+# program is started (see init_app); nothing is done on import
+MIXER_SETTINGS = (44100, -16, 2)  # Frequency, size, channels
+# Samples buffered by the mixer, i.e. ~93ms of delay before a sound is heard;
+# the smaller, low latency buffer (~12ms) may crackle on slower machines
+MIXER_BUFFER = 4096
+LOW_LATENCY_MIXER_BUFFER = 512
+# Pronunciations play on this many mixer channels of their own, so sound
+# effects never cut them off; at most this many decoded pronunciations (of
+# at most this many bytes in total) are kept, plus this many missing ones
+PRON_CHANNELS = 1
+PRON_CACHE_SIZE = 64
+PRON_CACHE_BYTES = 32 * 1024 * 1024
+PRON_MISSING_CACHE_SIZE = 1024
+PRON_VOLUME = 0.8
+# Sound effect name -> (path, volume)
+SOUND_EFFECTS = {
+    'new_session': ('sound/new_session.ogg', 0.9),
+    'card_flip': ('sound/card_flip.ogg', 0.2),
+    'toggle': ('sound/toggle.ogg', 0.05),
+    'appear': ('sound/appear.ogg', 0.2),
+    'lurnt': ('sound/lurnt.ogg', 0.1),
+    'pop': ('sound/popup.ogg', 0.2),
+    'quit': ('sound/quit.ogg', 0.2)
+}
+IMAGE_PATHS = {
+    'bricks_background': 'img/bricks_background.png',
+    'pronounce': 'img/pronounce_icon.png',
+    'pass': 'img/pass_icon.png',
+    'fail': 'img/fail_icon.png',
+    'ellipsis': 'img/ellipsis_icon.png',
+    'left': 'img/left_icon.png',
+    'lurnt': 'img/lurnt_icon.png'
+}
+# Icons are drawn at one of three sizes, each the width of the named image
+ICON_SIZE_IMAGES = {'small': 'ellipsis', 'large': 'pass', 'lurnt': 'lurnt'}
+
 WINDOW_W, WINDOW_H = (800,500)
 WINDOW_RECT = pg.Rect(0, 0, WINDOW_W, WINDOW_H)
-WINDOW = pg.display.set_mode((WINDOW_W, WINDOW_H), 0, 32)
-pg.display.set_caption("Würd Lürnür v1.0")
-CLOCK = pg.time.Clock()
-
-BRICKS_BACKGROUND = pg.image.load('img/bricks_background.png').convert_alpha()
-PRONOUNCE_ICON = pg.image.load('img/pronounce_icon.png').convert_alpha()
-PASS_ICON = pg.image.load('img/pass_icon.png').convert_alpha()
-FAIL_ICON = pg.image.load('img/fail_icon.png').convert_alpha()
-ELLIPSIS_ICON = pg.image.load('img/ellipsis_icon.png').convert_alpha()
-LEFT_ICON = pg.image.load('img/left_icon.png').convert_alpha()
-RIGHT_ICON = pg.transform.rotate(LEFT_ICON, 180)
-LURNT_ICON = pg.image.load('img/lurnt_icon.png').convert_alpha()
-
-SMALL_ICON = ELLIPSIS_ICON.get_width()
-LARGE_ICON = PASS_ICON.get_width()
-ICON_SIZE_LURNT = LURNT_ICON.get_width()
+WINDOW_CAPTION = "Würd Lürnür v1.0"
+# Posted at 60 FPS, but only while something on screen is animating (i.e. the
+# slider is being dragged); otherwise the main loop sleeps until there's input
+FRAME_TIMER_EVENT = pg.USEREVENT
+FRAME_TIMER_MS = 1000 // 60
 
 WORD_IMG_SIZE = 150  # Image next to word definition
+WORD_IMG_CACHE_SIZE = 32  # Max number of decoded word images kept in memory
+# Images and pronunciations of this many cards ahead of / behind the current
+# card are loaded in the background by a pool of this many worker threads
+PREFETCH_AHEAD = 3
+PREFETCH_BEHIND = 1
+PREFETCH_WORKERS = 2
 PAD = 4  # General padding constant; various multiples used to separate objects
 SLIDER_WINDOW_MARGIN_Y = 20
 SLIDER_W, SLIDER_H = (600,50)
@@ -122,42 +172,88 @@ PREV_NEXT_BUTTON_W, PREV_NEXT_BUTTON_H = (75,75)
 
 
 class Session:
-    def __init__ (self, session_df, full_df):
-        self.cards_df = session_df.copy()  # Copy df to prevent changes to orig.
-        self.full_df = full_df.copy()
-        # Isolate number portion of last stored Session name and add 1
-        last_session_name = list(self.cards_df)[-1]
-        last_index = int(last_session_name.split('#')[1].split(' -')[0])
-        self.index = last_index + 1
-
+    def __init__ (self, session_df, repository, lurnt_passes=LURNT_PASSES,
+                  lurnt_interval=LURNT_INTERVAL_DAYS):
+        self.cards_df = session_df  # Full rows of this Session's cards only
+        self.repository = repository
+        self.lurnt_passes = lurnt_passes
+        self.lurnt_interval = lurnt_interval
+        self.index = self.repository.last_session_id + 1
         self.timestamp = get_timestamp_now()
-        self.name = f'Session #{self.index} - {self.timestamp}'
-        self.full_df[self.name] = ''  # Add empty column for new session
 
         self.current_card_index = 0
         self.showing_stats = False
         self.pronounce_icon_rect = None  # X-position altered by size of word
 
         # Initialize tallies which are shown when 'Show Stats' clicked
-        self.db_total_card_count = len(full_df)
+        self.db_total_card_count = self.repository.card_count()
         self.card_count = len(self.cards_df.index)
         self.pass_count = 0
         self.fail_count = 0
         self.skip_count = 0
         self.lurnt_count = 0
 
-        # Create list of Card objects containing every word added to Session
-        self.cards = []
-        for i in range(self.card_count):
-            self.cards.append(Card(self.cards_df.iloc[i]))
+        # Card objects are only created once the User reaches them, so
+        # Session start-up time doesn't depend on the number of cards added
+        self.cards = [None] * self.card_count
+        self.prefetch_assets()
 
         # Store all static Text and Rect objects in two dicts
         self.text, self.rects = get_all_static_surfaces()
+        self.static_layers = {}  # Pre-rendered backgrounds of card screen
+
 
+    @property
+    def current_card(self):
+        return self.get_card(self.current_card_index)
+
+    def get_card(self, index):
+        if self.cards[index] is None:
+            self.cards[index] = Card(self.cards_df.iloc[index],
+                                     self.repository, self.lurnt_passes,
+                                     self.lurnt_interval)
+        return self.cards[index]
+
+    def prefetch_assets(self):
+        # Start loading assets for cards surrounding the current card
+        first = max(0, self.current_card_index - PREFETCH_BEHIND)
+        last = min(self.card_count,
+                   self.current_card_index + PREFETCH_AHEAD + 1)
+        prefetch_word_assets(self.cards_df['Word'].iloc[first:last])
+
+    def get_visual_state(self, card):
+        # Everything that determines what the card screen looks like; the
+        # screen is only redrawn when this changes
+        return {
+            'card': self.current_card_index,
+            'stats': self.showing_stats,
+            'result': card.result,
+            'context': card.show_context,
+            'definition': card.show_definition,
+            'image': card.show_image,
+            'hover': card.get_hovered_history_state()
+        }
+
+    def get_dirty_rects(self, old_state, new_state):
+        # Areas of the screen affected by a change from old to new state
+        if ((old_state is None) or ('card' not in old_state)
+                or (old_state['card'] != new_state['card'])
+                or (old_state['stats'] != new_state['stats'])
+                or (old_state['hover'] != new_state['hover'])):
+            return [WINDOW_RECT]
+        frames = {
+            'result': 'register_frame',
+            'context': 'context_frame',
+            'definition': 'defi_frame',
+            'image': 'img_frame'
+        }
+        return [self.rects[frame] for key, frame in frames.items()
+                if old_state[key] != new_state[key]]
 
     def show_stats(self):
-        dim_rect(WINDOW, WINDOW_RECT, DARK_GREY, alpha=192)
-        draw_box(WINDOW, self.rects['stats_frame'], LIGHT_BLUE, DARK_GREY)
+        window = get_window()
+        dim_rect(window, WINDOW_RECT, DARK_GREY, alpha=192)
+        draw_box(window, self.rects['stats_frame'], LIGHT_BLUE, DARK_GREY)
         self.text['stats_header'].draw()
         self.text['ok_awesome'].draw(button=True)
 
@@ -183,7 +279,7 @@ class Session:
     def update_tallies(self, change_to):
         # Update the pass/fail/skip 'result' tallies; subtract from prev
         # result before adding to new result tally
-        card = self.cards[self.current_card_index]
+        card = self.current_card
         change_from = card.result  # Result value prior to change
         if change_from == 'skip':
             self.skip_count -= 1
@@ -198,18 +294,18 @@ class Session:
             self.skip_count += 1
         elif change_to == 'pass':
             self.pass_count += 1
-            if card.passes_count == 4:
+            if card.would_be_lurnt('pass'):
                 self.lurnt_count += 1
         elif change_to == 'fail':
             self.fail_count += 1
 
     def change_card(self, direction):
-        card = self.cards[self.current_card_index]
+        card = self.current_card
         if card.lurnt and not card.popup_played:
             card.lurnt_popup(self)
             card.popup_played = True
         else:
-            CARD_FLIP_SFX.play()
+            get_sfx('card_flip').play()
         if card.result is None:
             # Manually flag this card as a 'skip'
             self.update_tallies('skip')
@@ -223,69 +319,126 @@ class Session:
             self.current_card_index += 1
         else:
             raise ValueError('Invalid direction for card change.')
+        self.prefetch_assets()
 
     def update_database(self):
-        # Updates internally-stored dataframe and overrides .csv file with it
-        word = self.cards[self.current_card_index].word
-        result = self.cards[self.current_card_index].result
-        is_lurnt = self.cards[self.current_card_index].lurnt
-
-        if is_lurnt:
-            self.full_df.loc[self.full_df['Word']==word,['Lurnt']] = 'yes'
-        else:
-            self.full_df.loc[self.full_df['Word']==word,['Lurnt']] = ''
-
+        # Updates the current card's row (looked up by its unique Card ID)
+        # through whichever storage backend the Session was started with;
+        # a card left without a result (e.g. on quitting) isn't written, as
+        # only registered results are stored
+        card_id = self.current_card.id
+        result = self.current_card.result
+        is_lurnt = self.current_card.lurnt
+
+        if result is None:
+            return
         if result == 'skip':
             result = '-'  # Mark any skipped words with a dash
-        self.full_df.loc[self.full_df['Word']==word,[self.name]] = result
-        self.full_df.to_csv('cards.csv', index=False, encoding='utf-8-sig')
+        self.repository.update_card(
+            card_id, self.index, self.timestamp, result, is_lurnt
+        )
 
-        # Centre pop-up message on screen and hold for half a second but allow
+        # Centre pop-up message on screen and hold for a moment but allow
         # User to exit with any key (except Q and W which exit the program)
-        dim_rect(WINDOW, WINDOW_RECT, DARK_GREY, alpha=192)
+        window = get_window()
+        dim_rect(window, WINDOW_RECT, DARK_GREY, alpha=192)
         updating_text = Text("Updating database...", LARGE_FONT)
         popup_w = updating_text.w + 4*PAD  # Extra padding on sides
         popup_h = updating_text.h + 2*PAD
         popup_rect = pg.Rect((WINDOW_W-popup_w)//2, (WINDOW_H-popup_h)//2,
                              popup_w, popup_h)
-        draw_box(WINDOW, popup_rect, LIGHT_BLUE, DARK_GREY)
+        draw_box(window, popup_rect, LIGHT_BLUE, DARK_GREY)
         updating_text.x = popup_rect.left + 2*PAD
         updating_text.y = popup_rect.top + PAD
         updating_text.draw()
 
         pg.display.flip()
         current_time = pg.time.get_ticks()
-        exit_time = current_time + 500
+        exit_time = current_time + UPDATING_POPUP_MS
 
         while current_time < exit_time:
+            event = wait_for_events(timeout=exit_time-current_time)
             current_time = pg.time.get_ticks()
-            event = pg.event.get()
             for e in event:
                 if ((e.type==pg.KEYDOWN and (e.key==pg.K_q or e.key==pg.K_w))
                         or (e.type == pg.QUIT)):
-                    terminate_program()
+                    terminate_program(self)
                 elif e.type == pg.KEYDOWN:
                     current_time = exit_time
-            CLOCK.tick(5)
 
     def draw_card_screen(self, card):
-        draw_box(WINDOW, self.rects['card_frame'], card.color, DARK_GREY)
-        self.text['session_stats'].draw(button=True)
-        self.text['quit'].draw(button=True)
+        # Everything that is the same for all cards of the same color comes
+        # pre-rendered in the static layer; cards only draw their content
+        get_window().blit(self.get_static_layer(card.color), (0,0))
 
         card.draw_word_frame(self)
         card.draw_context_frame(self)
         card.draw_defi_frame(self)
         card.draw_register_frame(self)
-        card.draw_next_prev_buttons(self)
         if card.result_history:
             card.draw_result_history(self)
 
+    def get_static_layer(self, color):
+        # Background, frames, headers and buttons of card screen, rendered
+        # once per window size and card (part of speech) color
+        window_size = get_window().get_size()
+        key = (window_size, color)
+        if key not in self.static_layers:
+            layer = pg.Surface(window_size).convert()
+            layer.blit(get_image('bricks_background'), (0,0))
+            draw_box(layer, self.rects['card_frame'], color, DARK_GREY)
+            self.text['session_stats'].draw(button=True, surface=layer)
+            self.text['quit'].draw(button=True, surface=layer)
+
+            draw_box(layer, self.rects['word_frame'])
+            draw_box(layer, self.rects['context_frame'])
+            self.text['context_header'].draw(surface=layer)
+            self.text['show_hide_cxt'].draw(button=True, surface=layer)
+            draw_box(layer, self.rects['defi_frame'])
+            draw_box(layer, self.rects['img_frame'])
+            self.text['definition_header'].draw(surface=layer)
+            self.text['show_hide_def'].draw(button=True, surface=layer)
+            draw_box(layer, self.rects['register_frame'], fill_color=WHITE)
+            self.text['register_header'].draw(surface=layer)
+            self.draw_next_prev_buttons(layer)
+            self.static_layers[key] = layer
+        return self.static_layers[key]
+
+    def draw_next_prev_buttons(self, surface):
+        # Build 'prev card'/'next card' buttons out of arrow icons & text
+        icon_atlas = get_icon_atlas()
+        large_icon = get_icon_size('large')
+        left_icon_x = (self.rects['prev_button'].left
+                       + (PREV_NEXT_BUTTON_W - large_icon) // 2)
+        right_icon_x = (self.rects['next_button'].left
+                       + (PREV_NEXT_BUTTON_W - large_icon) // 2)
+        icon_y = self.rects['prev_button'].bottom - large_icon - PAD
+
+        # Reuse 'card' Text object for both buttons by toggling x-position
+        draw_box(surface, self.rects['prev_button'], fill_color=WHITE)
+        self.text['previous'].draw(surface=surface)
+        self.text['card'].x = (self.rects['prev_button'].left +
+            (self.rects['prev_button'].width-self.text['card'].w) // 2)
+        self.text['card'].draw(surface=surface)
+        icon_atlas.draw(surface, ('left', large_icon), (left_icon_x, icon_y))
+
+        draw_box(surface, self.rects['next_button'], fill_color=WHITE)
+        self.text['next'].draw(surface=surface)
+        self.text['card'].x = (self.rects['next_button'].left +
+            (self.rects['next_button'].width-self.text['card'].w) // 2)
+        self.text['card'].draw(surface=surface)
+        icon_atlas.draw(surface, ('right', large_icon), (right_icon_x, icon_y))
+
 
 class Card:
-    def __init__ (self, card_data):
+    def __init__ (self, card_data, repository, lurnt_passes=LURNT_PASSES,
+                  lurnt_interval=LURNT_INTERVAL_DAYS):
+        self.id = int(card_data.get('Card ID'))
         self.word = card_data.get('Word')
         self.word_variations = self.get_word_variations(card_data)
+        self.highlight_pattern = compile_highlight_pattern(
+            self.word_variations
+        )
 
         self.pos_abbrev = card_data.get('Part of Speech').lower()
         self.pos_full_name = PARTS_OF_SPEECH[self.pos_abbrev]['full name']
@@ -299,22 +452,35 @@ class Card:
         if len(self.definition) > MAX_DEF_CHARS:
             self.definition = self.definition[:MAX_DEF_CHARS-3] + ('...')
 
-        past_sessions = card_data.iloc[FIRST_SESSION_COL_INDEX:]
-        self.result_history = self.get_result_history(past_sessions)
-        self.passes_count = self.count_passes(self.result_history)
+        # Past results are read from the card's summary, which the storage
+        # backend keeps up to date; only the latest pass/fail results are
+        # kept in it, each as a dict with 'result' and 'timestamp' keys
+        summary = repository.summary(self.id)
+        self.result_history = summary['recent']
+        self.history_count = summary['passes'] + summary['fails']
+        self.passes_count = summary['passes']
+        self.schedule = get_schedule(summary)
+        self.lurnt_passes = lurnt_passes
+        self.lurnt_interval = lurnt_interval
         self.result = None
 
         self.lurnt = False  # Must be false since lurnt words were excluded
         self.popup_played = False  # To ensure victory pop-up only plays once
+        self.history_icon_rects = []  # Positions of last drawn history icons
         self.show_context = True
         self.show_definition = False
         self.show_image = False
-        self.img_path = f'./word_img/{self.word.lower()}.png'
-        try:
-            self.word_img = pg.image.load(self.img_path).convert_alpha()
-        except Exception as e:
-            print(f'{e.__class__.__name__}: image for {self.word}.')
-            self.word_img = None
+        # Either is None if the word has no such asset (see asset_manifest.py)
+        self.img_path = get_word_img_path(self.word)
+        self.pron_path = get_word_pron_path(self.word)
+
+    @property
+    def word_img(self):
+        # Image is only decoded when first shown, and only a limited number
+        # of decoded images are kept around (see load_word_image)
+        if self.img_path is None:
+            return None
+        return load_word_image(self.img_path)
 
 
     def get_word_variations(self, card_data):
@@ -338,32 +504,14 @@ class Card:
             word_variations.sort(key=len, reverse=True)
         return word_variations
 
-    def get_result_history(self, past_sessions):
-        result_history = []
-        for col_name, value in past_sessions.iteritems():
-            if value in ('pass', 'fail'):
-                # Last 16 characters of column names are always the timestamp
-                # of when that session was created
-                past_session = {'result': value, 'timestamp': col_name[-16:]}
-                result_history.append(past_session)
-        return result_history
-
-    def count_passes(self, result_history):
-        # Tally up all the passes from past sessions
-        past_passes = 0
-        for entry in self.result_history:
-            if entry['result'] == 'pass':
-                past_passes += 1
-        return past_passes
-
     def pronounce(self):
-        try:
-            word_pronunciation = pg.mixer.Sound(f'word_pron/{self.word}.ogg')
-            word_pronunciation.set_volume(0.8)
-            word_pronunciation.play()
-        except Exception as e:
-            error_type = e.__class__.__name__
-            print(f"{error_type}: pronunciation for '{self.word}'.")
+        # Decoded once (usually ahead of time; see prefetch_word_assets) and
+        # then kept, so saying the word again starts straight away
+        if self.pron_path is None:
+            return
+        get_audio().pronounce(self.pron_path, lambda: _prefetcher.take(
+            ('pron', self.pron_path), lambda: decode_word_pron(self.pron_path)
+        ))
 
     def toggle_result_selections(self):
         # Toggles across the 3 options left to right and returns new result
@@ -376,21 +524,23 @@ class Card:
 
     def update_result(self, new_result, play_sfx=True):
         if play_sfx:
-            TOGGLE_SFX.play()
+            get_sfx('toggle').play()
         self.result = new_result
-        if (self.result=='pass') and (self.passes_count==4):
-            # After 5 passes total, flag card as 'lurnt'
-            self.lurnt = True
+        self.lurnt = self.would_be_lurnt(self.result)
+
+    def would_be_lurnt(self, result):
+        # Whether given result (in this session) makes the card 'lurnt'
+        return is_lurnt_result(result, self.passes_count, self.schedule,
+                               self.lurnt_passes, self.lurnt_interval)
 
     def draw_word_frame(self, session):
         # Centre objects horizontally in frame adding padding in between;
         # also centre vertically according to each object's individual height;
         # finally, store position of this card's pronunciation icon
-        draw_box(WINDOW, session.rects['word_frame'])
-
+        large_icon = get_icon_size('large')
         word_text = Text(self.word.replace(' - ', '/'), GIANT_FONT)
         pos_text = Text(f'({self.pos_abbrev})', LARGE_FONT)
-        total_w = word_text.w + pos_text.w + LARGE_ICON + 2*PAD
+        total_w = word_text.w + pos_text.w + large_icon + 2*PAD
 
         word_text.x = (WINDOW_W - total_w) // 2
         word_text.y = (session.rects['word_frame'].top
@@ -404,57 +554,52 @@ class Card:
 
         icon_x = pos_text.x + pos_text.w + PAD
         icon_y = (session.rects['word_frame'].top
-                  + (WORD_FRAME_H - LARGE_ICON) // 2)
-        WINDOW.blit(PRONOUNCE_ICON, (icon_x, icon_y))
+                  + (WORD_FRAME_H - large_icon) // 2)
+        get_icon_atlas().draw(get_window(), ('pronounce', large_icon),
+                              (icon_x, icon_y))
         session.pronounce_icon_rect = pg.Rect(
-            icon_x, icon_y, LARGE_ICON, LARGE_ICON
+            icon_x, icon_y, large_icon, large_icon
         )
 
     def draw_result_history(self, session):
-        if len(self.result_history) > 10:
-            # If more than 10 pass/fail results stored, show only the last 10
-            icon_count = 10
-            entries = self.result_history[-10:]
-            add_ellipsis = True
-        else:
-            icon_count = len(self.result_history)
-            entries = self.result_history
-            add_ellipsis = False
+        # Only the latest pass/fail results (at most 10) are kept in a card's
+        # summary; an ellipsis is added if there were any more before them
+        icon_count = len(self.result_history)
+        entries = self.result_history
+        add_ellipsis = self.history_count > icon_count
 
         # (Small) pass, fail & ellipsis icons all expected to be of same size;
         # spaces to add padding = number of icons + 1
-        icons_rect_w = (icon_count * (SMALL_ICON+PAD)) + PAD
+        window = get_window()
+        icon_atlas = get_icon_atlas()
+        small_icon = get_icon_size('small')
+        icons_rect_w = (icon_count * (small_icon+PAD)) + PAD
         if add_ellipsis:  # Make room for ellipsis icon if needed
-            icons_rect_w += SMALL_ICON + PAD
+            icons_rect_w += small_icon + PAD
 
-        icons_rect_h = SMALL_ICON + 2*PAD
+        icons_rect_h = small_icon + 2*PAD
         icons_rect_x = WINDOW_W - CARD_FRAME_MARGIN_X - icons_rect_w
         icons_rect_y = CARD_FRAME_MARGIN_Y - PAD - icons_rect_h
-        draw_box(WINDOW,
+        draw_box(window,
             pg.Rect((icons_rect_x, icons_rect_y, icons_rect_w, icons_rect_h)))
 
         # Draw icons in chronological sequence from left to right; store icon
         # surfaces in list for later mouse hovering collision handling
         icon_rects = []
+        self.history_icon_rects = icon_rects
         icon_x = icons_rect_x + PAD
         icon_y = icons_rect_y + PAD
         if add_ellipsis:
-            WINDOW.blit(ELLIPSIS_ICON, (icon_x, icon_y))
-            icon_x += SMALL_ICON + PAD
+            icon_atlas.draw(window, ('ellipsis', small_icon), (icon_x, icon_y))
+            icon_x += small_icon + PAD
         for entry in entries:
-            if entry['result']=='pass':
-                icon = pg.transform.scale(
-                    PASS_ICON, (SMALL_ICON, SMALL_ICON)
-                )
-            else:
-                icon = pg.transform.scale(
-                    FAIL_ICON, (SMALL_ICON, SMALL_ICON)
-                )
-            WINDOW.blit(icon, (icon_x, icon_y))
+            # Pass/fail icons are pre-scaled to small size in the icon atlas
+            icon = 'pass' if entry['result']=='pass' else 'fail'
+            icon_atlas.draw(window, (icon, small_icon), (icon_x, icon_y))
             icon_rects.append(
-                pg.Rect(icon_x, icon_y, SMALL_ICON, SMALL_ICON)
+                pg.Rect(icon_x, icon_y, small_icon, small_icon)
             )
-            icon_x += SMALL_ICON + PAD
+            icon_x += small_icon + PAD
 
         # Show that session's timestamp if mouse hovering over icon
         for i, rect in enumerate(icon_rects):
@@ -471,11 +616,17 @@ class Card:
                 timestamp_text.y = mouse_y + 20  # Position 20px below mouse
                 timestamp_text.draw(faded_background=True)
 
-    def draw_context_frame(self, session):
-        draw_box(WINDOW, session.rects['context_frame'])
-        session.text['context_header'].draw()
-        session.text['show_hide_cxt'].draw(button=True)
+    def get_hovered_history_state(self):
+        # Index of history icon that the mouse is hovering over (if any) and
+        # the mouse position, since the timestamp shown follows the mouse
+        mouse_pos = pg.mouse.get_pos()
+        for i, rect in enumerate(self.history_icon_rects):
+            if rect.collidepoint(mouse_pos):
+                return i, mouse_pos
+        return None
 
+    def draw_context_frame(self, session):
+        # Frame, header and button are part of session's static layer
         if self.show_context:
             # Split, format, wrap, and draw text one line at a time: set x-pos
             # a bit past end of 'Definition' header with extra padding; split
@@ -498,17 +649,13 @@ class Card:
 
                 # Determine y-offset from first context example based on font
                 # size, and force a new line for second example
-                y_offset = line_count * (MEDIUM_FONT+3)
+                y_offset = line_count * (MEDIUM_FONT+LINE_SPACING)
                 _ = self.wrap_text(text=f'2. {self.context[split_pt+1:]}',
                     font_size=MEDIUM_FONT, max_width=max_width,
                     position=(text_x, text_y+y_offset), format='context')
 
     def draw_defi_frame(self, session):
-        draw_box(WINDOW, session.rects['defi_frame'])
-        draw_box(WINDOW, session.rects['img_frame'])
-        session.text['definition_header'].draw()
-        session.text['show_hide_def'].draw(button=True)
-
+        # Frames, header and button are part of session's static layer
         if self.show_definition:
             text_x = session.rects['defi_frame'].left + 2*PAD
             text_y = session.rects['defi_frame'].top + 2*PAD
@@ -518,19 +665,20 @@ class Card:
                     max_width=max_width, position=(text_x,text_y),
                     format='definition')
 
-        if self.word_img is not None and self.show_image:
+        if self.show_image and self.word_img is not None:
             # Centre image inside square frame
             img_x = (session.rects['img_frame'].left + PAD
                      + ((WORD_IMG_SIZE-self.word_img.get_width()) // 2))
             img_y = (session.rects['img_frame'].top + PAD
                      + ((WORD_IMG_SIZE-self.word_img.get_height()) // 2))
-            WINDOW.blit(self.word_img, (img_x, img_y))
+            get_window().blit(self.word_img, (img_x, img_y))
 
     def draw_register_frame(self, session):
-        draw_box(WINDOW, session.rects['register_frame'], fill_color=WHITE)
-        session.text['register_header'].draw()
-
+        # Frame and header are part of session's static layer
         # Change text color scheme and position of blue 'selection' rectangle
+        window = get_window()
+        icon_atlas = get_icon_atlas()
+        large_icon = get_icon_size('large')
         if self.result == 'pass':
             header_colors = [BLACK, MEDIUM_GREY, MEDIUM_GREY]
             select_rect = session.rects['pass_button']
@@ -542,7 +690,7 @@ class Card:
             select_rect = session.rects['fail_button']
 
         if self.result is not None:
-            draw_box(WINDOW, select_rect, LIGHT_BLUE, MEDIUM_GREY)
+            draw_box(window, select_rect, LIGHT_BLUE, MEDIUM_GREY)
 
         # Draw pass/skip/fail headers using color scheme based on selection
         pass_text = Text('PASS', SMALL_FONT, header_colors[0])
@@ -568,195 +716,49 @@ class Card:
         icon_y = pass_text.rect.bottom + PAD
         if self.result == 'pass':
             icon_x = (session.rects['pass_button'].left
-                + (session.rects['pass_button'].width - LARGE_ICON) // 2)
-            WINDOW.blit(PASS_ICON, (icon_x, icon_y))
+                + (session.rects['pass_button'].width - large_icon) // 2)
+            icon_atlas.draw(window, ('pass', large_icon), (icon_x, icon_y))
         elif self.result == 'fail':
             icon_x = (session.rects['fail_button'].left
-                + (session.rects['fail_button'].width - LARGE_ICON) // 2)
-            WINDOW.blit(FAIL_ICON, (icon_x, icon_y))
-
-    def draw_next_prev_buttons(self, session):
-        # Build 'prev card'/'next card' buttons out of arrow icons & text
-        left_icon_x = (session.rects['prev_button'].left
-                       + (PREV_NEXT_BUTTON_W - LARGE_ICON) // 2)
-        right_icon_x = (session.rects['next_button'].left
-                       + (PREV_NEXT_BUTTON_W - LARGE_ICON) // 2)
-        icon_y = session.rects['prev_button'].bottom - LARGE_ICON - PAD
-
-        # Reuse 'card' Text object for both buttons by toggling x-position
-        draw_box(WINDOW, session.rects['prev_button'], fill_color=WHITE)
-        session.text['previous'].draw()
-        session.text['card'].x = (session.rects['prev_button'].left +
-            (session.rects['prev_button'].width-session.text['card'].w) // 2)
-        session.text['card'].draw()
-        WINDOW.blit(LEFT_ICON, (left_icon_x, icon_y))
-
-        draw_box(WINDOW, session.rects['next_button'], fill_color=WHITE)
-        session.text['next'].draw()
-        session.text['card'].x = (session.rects['next_button'].left +
-            (session.rects['next_button'].width-session.text['card'].w) // 2)
-        session.text['card'].draw()
-        WINDOW.blit(RIGHT_ICON, (right_icon_x, icon_y))
-
-    def format_context(self, line_text, text_x, text_y, font_size,
-                       line_count, surface=WINDOW):
-        # Highlight any instances of the word (or its variations) in the
-        # color corresponding to its part of speech
-        x_offset = 0
-        while len(line_text) > 0:
-            cutoff_char = len(line_text)
-            leftmost_word = None
-            for word in self.word_variations:
-                # Split text at the left-most occurence of the word; since
-                # word variations ordered in decreasing order, longer words
-                # searched first, ensuring full word gets captured; e.g.
-                # 'demurred' caught before 'demur', so '-red' ending included
-                word_index = line_text.find(word)
-                if (word_index != -1) and (word_index < cutoff_char):
-                    leftmost_word = word
-                    cutoff_char = word_index
-
-            if cutoff_char > 0:
-                # Output all text up to cutoff char in regular font, as this
-                # is either the whole line (default), or only up to beginning
-                # of the word to be highlighted; manually remove auto-padding
-                regular_text = Text(line_text[:cutoff_char], font_size)
-                regular_text.x = text_x + x_offset
-                regular_text.y = text_y + (line_count * (font_size+3))
-                regular_text.draw()
-
-                x_offset += regular_text.w - 2*PAD
-                line_text = line_text[cutoff_char:]
-
-            if leftmost_word is not None:
-                # Output highlighted word and keep only text that follows it
-                highlighted_word = Text(leftmost_word, font_size, self.color)
-                highlighted_word.x = text_x + x_offset
-                highlighted_word.y = text_y + (line_count * (font_size+3))
-                highlighted_word.draw()
-
-                x_offset += (highlighted_word.w - 2*PAD)
-                line_text = line_text[len(leftmost_word):]
-
-            elif line_text.startswith(' '):
-                # If remaining text starts with an empty space, remove it
-                line_text = line_text[1:]
-
-    def format_definition(self, line_text, text_x, text_y, font_size,
-                          line_count, surface=WINDOW):
-        # Output any text within '[]' brackets in brown and superscript (ssc);
-        # (expects string that begins with '[' and has a single ']')
-        x_offset = 0
-        close_bracket_index = line_text.find(']')
-        ssc_text = Text(line_text[:close_bracket_index+1], font_size-5, BROWN)
-        ssc_text.x = text_x + x_offset
-        ssc_text.y = text_y + line_count*(font_size+3) - 3  # Shifted 3px up
-        ssc_text.draw(surface=surface)
-
-        x_offset += ssc_text.w
-        remaining_text = Text(line_text[close_bracket_index+1:], font_size)
-        remaining_text.x = text_x + x_offset
-        remaining_text.y = text_y + line_count*(font_size+3)
-        remaining_text.draw(surface=surface)
+                + (session.rects['fail_button'].width - large_icon) // 2)
+            icon_atlas.draw(window, ('fail', large_icon), (icon_x, icon_y))
 
     def wrap_text(self, text, font_size, max_width, position,
-                  color=DARK_BLUE, surface=WINDOW, format=None):
-        # Assuming even distribution of wide and narrow chars, char limit
-        # is calculated by reducing number of chars proportionally to width
-        full_text = Text(text, font_size)
-        char_limit_per_line = int(len(text) * max_width/full_text.w)
-        line_count = 0
+                  color=DARK_BLUE, surface=None, format=None):
+        # Text is laid out into positioned runs once (see layout_text), so
+        # each frame only has to blit the cached runs; returns line count
+        if surface is None:
+            surface = get_window()
+        runs, line_count = layout_text(
+            text, font_size, max_width, format,
+            highlight_pattern=self.highlight_pattern,
+            highlight_color=self.color
+        )
         text_x, text_y = position
-
-        while len(text) > 0:
-            line_chars = char_limit_per_line
-            # If small-font superscript chars present, compensate width by
-            # manually extending limit by 1 char for every 3 superscript chars
-            if ((format == 'definition') and
-                    (text[:line_chars].find('[') != -1) and
-                    (text[:line_chars].find(']') != -1)):
-                open_bracket_index = text[:line_chars].find('[')
-                close_bracket_index = text[:line_chars].find(']')
-                ssc_text = text[open_bracket_index : close_bracket_index+1]
-                line_chars += (len(ssc_text) // 3)
-            # If not last line, find word end by shifting to left one by one
-            if len(text) > line_chars:
-                while not text[:line_chars].endswith(' '):
-                    line_chars -= 1
-            else:
-                line_chars = len(text)
-            line_text = text[:line_chars]
-
-            # Formatting specific to 'context' and 'definition' sections
-            if format == 'context':
-                self.format_context(
-                    line_text, text_x, text_y, font_size, line_count
-                )
-            # Formatting specific to the 'definition' section
-            elif format == 'definition':
-                # Opening bracket '[' indicates the start of a 'domain' tag to
-                # the word's definition, e.g. [in Law] or [archaic]; ensure
-                # closing bracket exists on same line, and force a new line
-                # for any domain tags found
-                open_bracket_index = line_text.find('[')
-                if open_bracket_index == 0:  # '[' is first char of line
-                    close_bracket_index = line_text.find(']')
-                    if close_bracket_index == -1:
-                        text_to_output = Text(line_text, font_size)
-                        text_to_output.x = text_x
-                        text_to_output.y = text_y + line_count*(font_size+3)
-                        text_to_output.draw(surface=surface)
-                    else:
-                        # There could be multiple '[]' sets on single line;
-                        # ensure that only single tag is sent to formatting
-                        next_bracket_index = line_text[1:].find('[')
-                        if next_bracket_index != -1:
-                            # Compensate for [1:] char skip
-                            next_bracket_index += 1
-                            line_text = line_text[:next_bracket_index]
-                            line_chars = len(line_text)
-                        self.format_definition(
-                            line_text, text_x, text_y, font_size, line_count
-                        )
-                else:
-                    # Either no open bracket exists or there is text before
-                    # it, so next output will be non-superscript text
-                    if open_bracket_index > 0:
-                        # Open bracket exists but there is text before it so
-                        # force that text to be output first by truncating
-                        # line text to just this pre-bracket text
-                        line_text = line_text[:open_bracket_index]
-                        line_chars = len(line_text[:open_bracket_index])
-                    normal_text = Text(line_text, font_size)
-                    normal_text.x = text_x
-                    normal_text.y = text_y + line_count*(font_size+3)
-                    normal_text.draw(surface=surface)
-            # Output full line (basic text wrapping - no formatting)
-            else:
-                full_line_text = Text(line_text, font_size)
-                full_line_text.x = text_x
-                full_line_text.y = text_y + line_count*(font_size+3)
-                full_line_text.draw(surface=surface)
-
-            text = text[line_chars:]
-            line_count += 1
+        for run_text, run_font_size, run_color, run_x, run_y in runs:
+            run_surface = get_text_surface(
+                run_text, run_font_size, run_color, PREFERRED_FONTS
+            )
+            surface.blit(run_surface, (text_x + run_x, text_y + run_y))
         return line_count
 
     def lurnt_popup(self, session):
-        LURNT_SFX.play()
+        get_sfx('lurnt').play()
         # Fade background with semi-transparent surface; find widest of the
         # two lines of text and base pop-up window width on that
-        dim_rect(WINDOW, WINDOW_RECT, DARK_GREY, alpha=192)
+        window = get_window()
+        lurnt_icon_size = get_icon_size('lurnt')
+        dim_rect(window, WINDOW_RECT, DARK_GREY, alpha=192)
         line_1_text = Text("Congrats! You've lürnt", LARGE_FONT)
         lurnt_word_text = Text(self.word, GIANT_FONT, BLACK)
-        line_2_total_w = lurnt_word_text.w + 3*PAD + ICON_SIZE_LURNT
+        line_2_total_w = lurnt_word_text.w + 3*PAD + lurnt_icon_size
         popup_frame_w = max(line_1_text.w,line_2_total_w) + 6*PAD
 
         popup_frame_rect = pg.Rect(
             (WINDOW_W-popup_frame_w) // 2, (WINDOW_H-POPUP_FRAME_H) // 2,
             popup_frame_w, POPUP_FRAME_H
         )
-        draw_box(WINDOW, popup_frame_rect, LIGHT_BLUE, DARK_GREY)
+        draw_box(window, popup_frame_rect, LIGHT_BLUE, DARK_GREY)
 
         # Draw objects onto pop-up
         line_1_text.x = (popup_frame_rect.left
@@ -767,30 +769,30 @@ class Card:
         lurnt_icon_x = (popup_frame_rect.left
                          + (popup_frame_rect.width - line_2_total_w) // 2)
         lurnt_icon_y = line_1_text.rect.bottom + PAD
-        WINDOW.blit(LURNT_ICON, (lurnt_icon_x, lurnt_icon_y))
+        get_icon_atlas().draw(window, ('lurnt', lurnt_icon_size),
+                              (lurnt_icon_x, lurnt_icon_y))
 
-        lurnt_word_text.x = lurnt_icon_x + ICON_SIZE_LURNT + 3*PAD
+        lurnt_word_text.x = lurnt_icon_x + lurnt_icon_size + 3*PAD
         lurnt_word_text.y = lurnt_icon_y - PAD
         lurnt_word_text.draw()
 
-        # Display pop-up for two seconds before it disappears
+        # Display pop-up for a couple of seconds before it disappears
         pg.display.flip()
         current_time = pg.time.get_ticks()
-        exit_time = current_time + 2000
+        exit_time = current_time + LURNT_POPUP_MS
 
         while current_time < exit_time:
+            event = wait_for_events(timeout=exit_time-current_time)
             current_time = pg.time.get_ticks()
-            event = pg.event.get()
             for e in event:
                 # Allow User to terminate program with Q or W when pop-up is
                 # displaying; any other key will exit pop-up instantly
                 if ((e.type==pg.KEYDOWN and (e.key==pg.K_q or e.key==pg.K_w))
                         or (e.type == pg.QUIT)):
                     session.update_database()
-                    terminate_program()
+                    terminate_program(session)
                 elif e.type == pg.KEYDOWN:
                     current_time = exit_time
-            CLOCK.tick(5)
 
 
 class Slider:
@@ -867,13 +869,23 @@ class Slider:
                                 center=(self.button_x, self.h//2))
         surface.blit(self.button_surface, self.button_rect)
         self.button_rect.move_ip(self.x, self.y)
-        WINDOW.blit(surface, (self.x, self.y))
+        get_window().blit(surface, (self.x, self.y))
 
         # Update x-position and text based on slider
         self.val_text.text = str(int(self.val))
         self.val_text.x = self.x + self.button_x - (self.val_text.w // 2)
         self.val_text.draw(faded_background=True)
 
+    def get_visual_state(self):
+        return {'slider': self.val}
+
+    def get_dirty_rects(self, old_state, new_state):
+        # Only the slider and the value underneath it move on slider screen
+        if (old_state is None) or ('slider' not in old_state):
+            return [WINDOW_RECT]
+        return [pg.Rect(0, self.y - PAD, WINDOW_W,
+                        self.h + self.val_text.h + 3*PAD)]
+
     def move(self, auto_move_amount=None):
         old_val = self.val
         if not auto_move_amount:
@@ -924,7 +936,9 @@ class Text:
         else:
             return None
 
-    def draw(self, button=False, faded_background=False, surface=WINDOW):
+    def draw(self, button=False, faded_background=False, surface=None):
+        if surface is None:
+            surface = get_window()
         if self.rect is not None:
             if button:
                 draw_box(surface, self.rect, fill_color=WHITE)
@@ -1084,12 +1098,316 @@ def get_all_static_surfaces():
     return text, rects
 
 
+@lru_cache(maxsize=TEXT_LAYOUT_CACHE_SIZE)
+def layout_text(text, font_size, max_width, format=None,
+                highlight_pattern=None, highlight_color=None):
+    # Wrap text into lines no wider than max_width and split each line into
+    # runs of same-styled text; returns a tuple of runs, each as (text, font
+    # size, color, x, y) relative to the text's position, and the line count.
+    # Formatting: 'context' highlights all matches of the highlight pattern
+    # (see compile_highlight_pattern) and 'definition' shows '[]' domain tags
+    # in superscript
+    runs = []
+    line_count = 0
+    while len(text) > 0:
+        line_chars = fit_line(text, font_size, max_width, format)
+        line_text = text[:line_chars]
+        line_y = line_count * (font_size+LINE_SPACING)
+
+        # Formatting specific to the 'context' section
+        if format == 'context':
+            runs.extend(layout_context_line(
+                line_text, line_y, font_size, highlight_pattern,
+                highlight_color
+            ))
+        # Formatting specific to the 'definition' section
+        elif format == 'definition':
+            # Opening bracket '[' indicates the start of a 'domain' tag to
+            # the word's definition, e.g. [in Law] or [archaic]; ensure
+            # closing bracket exists on same line, and force a new line
+            # for any domain tags found
+            open_bracket_index = line_text.find('[')
+            if open_bracket_index == 0:  # '[' is first char of line
+                close_bracket_index = line_text.find(']')
+                if close_bracket_index == -1:
+                    runs.append(
+                        (line_text, font_size, DARK_BLUE, PAD, line_y+PAD)
+                    )
+                else:
+                    # There could be multiple '[]' sets on single line;
+                    # ensure that only single tag is sent to formatting
+                    next_bracket_index = line_text[1:].find('[')
+                    if next_bracket_index != -1:
+                        # Compensate for [1:] char skip
+                        next_bracket_index += 1
+                        line_text = line_text[:next_bracket_index]
+                        line_chars = len(line_text)
+                    runs.extend(
+                        layout_definition_line(line_text, line_y, font_size)
+                    )
+            else:
+                # Either no open bracket exists or there is text before it,
+                # so next output will be non-superscript text
+                if open_bracket_index > 0:
+                    # Open bracket exists but there is text before it so
+                    # force that text to be output first by truncating line
+                    # text to just this pre-bracket text
+                    line_text = line_text[:open_bracket_index]
+                    line_chars = len(line_text)
+                runs.append((line_text, font_size, DARK_BLUE, PAD, line_y+PAD))
+        # Output full line (basic text wrapping - no formatting)
+        else:
+            runs.append((line_text, font_size, DARK_BLUE, PAD, line_y+PAD))
+
+        text = text[line_chars:]
+        line_count += 1
+    return tuple(runs), line_count
+
+def fit_line(text, font_size, max_width, format=None):
+    # Return number of chars of text that fit on a single line, measured with
+    # the font's real metrics and only ever breaking the line after a space
+    if measure_line(text, font_size, format) <= max_width:
+        return len(text)
+    line_chars = 0
+    space_index = text.find(' ')
+    while ((space_index != -1) and
+            (measure_line(text[:space_index], font_size, format)
+             <= max_width)):
+        line_chars = space_index + 1  # Keep space at end of line
+        space_index = text.find(' ', line_chars)
+    if line_chars == 0:
+        # First word is wider than the line on its own, so let it overflow
+        line_chars = space_index + 1 if space_index != -1 else len(text)
+    return line_chars
+
+def measure_line(line_text, font_size, format=None):
+    # Width of line of text once drawn; a definition's domain tag at the start
+    # of a line is drawn in a smaller font (see layout_definition_line)
+    font = get_font(PREFERRED_FONTS, font_size)
+    close_bracket_index = line_text.find(']')
+    if ((format == 'definition') and line_text.startswith('[')
+            and (close_bracket_index != -1)):
+        ssc_font = get_font(PREFERRED_FONTS, font_size-5)
+        return (ssc_font.size(line_text[:close_bracket_index+1])[0] + 2*PAD
+                + font.size(line_text[close_bracket_index+1:])[0])
+    return font.size(line_text)[0]
+
+def compile_highlight_pattern(words):
+    # Single regex matching any of the words (e.g. a card's word variations)
+    # in one pass over the text; of words found at the same place, the first
+    # in the list is used, so word variations ordered in decreasing length
+    # ensure full word gets captured, e.g. 'demurred' caught before 'demur',
+    # so '-red' ending included
+    words = [word for word in words if word]
+    return re.compile('|'.join(re.escape(word) for word in words))
+
+def layout_context_line(line_text, line_y, font_size, highlight_pattern,
+                        highlight_color):
+    # Highlight any instances of the word (or its variations) in the
+    # color corresponding to its part of speech
+    font = get_font(PREFERRED_FONTS, font_size)
+    runs = []
+    x_offset = PAD
+    regular_start = 0  # Start of text not yet output
+    if highlight_pattern is None:
+        matches = []
+    else:
+        matches = highlight_pattern.finditer(line_text)
+    for match in matches:
+        if match.start() > regular_start:
+            # Output all text up to beginning of the word to be highlighted in
+            # regular font
+            regular_text = line_text[regular_start:match.start()]
+            runs.append((regular_text, font_size, DARK_BLUE, x_offset,
+                         line_y+PAD))
+            x_offset += font.size(regular_text)[0]
+        runs.append((match.group(), font_size, highlight_color, x_offset,
+                     line_y+PAD))
+        x_offset += font.size(match.group())[0]
+        regular_start = match.end()
+
+    if regular_start < len(line_text):
+        # Output rest of line (or the whole line, if no words highlighted)
+        runs.append((line_text[regular_start:], font_size, DARK_BLUE,
+                     x_offset, line_y+PAD))
+    return runs
+
+def layout_definition_line(line_text, line_y, font_size):
+    # Output any text within '[]' brackets in brown and superscript (ssc);
+    # (expects string that begins with '[' and has a single ']')
+    close_bracket_index = line_text.find(']')
+    ssc_text = line_text[:close_bracket_index+1]
+    ssc_font = get_font(PREFERRED_FONTS, font_size-5)
+    ssc_w = ssc_font.size(ssc_text)[0]
+    return [
+        # Superscript shifted 3px up
+        (ssc_text, font_size-5, BROWN, PAD, line_y+PAD-3),
+        (line_text[close_bracket_index+1:], font_size, DARK_BLUE,
+         ssc_w + 3*PAD, line_y+PAD)
+    ]
+
+
+_app = None  # Application context, created by init_app() on start-up
+def init_app(low_latency=False):
+    # Initialize pygame and open the program's window (only done once)
+    global _app
+    if _app is None:
+        buffer = LOW_LATENCY_MIXER_BUFFER if low_latency else MIXER_BUFFER
+        _app = AppContext((WINDOW_W, WINDOW_H), WINDOW_CAPTION,
+                          MIXER_SETTINGS + (buffer,))
+    return _app
+
+def get_app():
+    if _app is None:
+        raise RuntimeError('init_app() must be called before anything is '
+                           'drawn or played.')
+    return _app
+
+def get_window():
+    return get_app().window
+
+def get_sfx(name):
+    # Sound effects are loaded the first time they're played
+    path, volume = SOUND_EFFECTS[name]
+    def load_sfx():
+        sfx = pg.mixer.Sound(path)
+        sfx.set_volume(volume)
+        return sfx
+    return get_app().get_asset(('sfx', name), load_sfx)
+
+def get_audio():
+    return get_app().get_asset('audio', lambda: AudioEngine(
+        PRON_CHANNELS, PRON_CACHE_SIZE, PRON_CACHE_BYTES,
+        PRON_MISSING_CACHE_SIZE, PRON_VOLUME
+    ))
+
+def get_image(name):
+    # Images are loaded the first time they're drawn
+    return get_app().get_asset(
+        ('img', name), lambda: pg.image.load(IMAGE_PATHS[name]).convert_alpha()
+    )
+
+def get_icon_size(size):
+    # Width of icons drawn at given size, i.e. 'small', 'large' or 'lurnt'
+    return get_image(ICON_SIZE_IMAGES[size]).get_width()
+
+def get_icon_atlas():
+    return get_app().get_asset('icon_atlas', build_icon_atlas)
+
+def build_icon_atlas():
+    # Every icon is drawn from a single atlas surface, holding it (pre-scaled)
+    # at each size used; icons are referred to by (name, size)
+    small_icon = get_icon_size('small')
+    large_icon = get_icon_size('large')
+    pass_icon = get_image('pass')
+    fail_icon = get_image('fail')
+    return IconAtlas({
+        ('pronounce', large_icon): get_image('pronounce'),
+        ('pass', large_icon): pass_icon,
+        ('fail', large_icon): fail_icon,
+        ('pass', small_icon): pg.transform.scale(pass_icon,
+                                                 (small_icon, small_icon)),
+        ('fail', small_icon): pg.transform.scale(fail_icon,
+                                                 (small_icon, small_icon)),
+        ('ellipsis', small_icon): get_image('ellipsis'),
+        ('left', large_icon): get_image('left'),
+        ('right', large_icon): pg.transform.rotate(get_image('left'), 180),
+        ('lurnt', get_icon_size('lurnt')): get_image('lurnt')
+    })
+
+
 def draw_box(surface, rect, fill_color=LIGHT_GREY, border_color=MEDIUM_GREY,
         corner_radius=5, border_thickness=2):
     # Wrapper function to set default values for local imported function
     draw_bordered_rounded_rect(surface, rect, fill_color, border_color,
         corner_radius, border_thickness)
 
+def get_asset_manifest():
+    # Asset directories are only listed again if they've changed since the
+    # manifest was last saved
+    return get_app().get_asset(
+        'asset_manifest', lambda: AssetManifest(ASSET_DIRS, MANIFEST_PATH)
+    )
+
+def get_asset_bundle():
+    # Bundle of already decoded assets made by bake_assets.py, or None
+    return get_app().get_asset('asset_bundle',
+                               lambda: open_bundle(BUNDLE_PATH))
+
+def get_word_img_path(word):
+    return get_asset_manifest().get_path('img', word)
+
+def get_word_pron_path(word):
+    return get_asset_manifest().get_path('pron', word)
+
+def decode_word_image(img_path):
+    # Word image over its pixels in the asset bundle (without decoding) if
+    # it's there, or else decoded from its file
+    bundle = get_asset_bundle()
+    if (bundle is not None) and (img_path in bundle):
+        return bundle.get_image(img_path)
+    return pg.image.load(img_path)
+
+def decode_word_pron(pron_path):
+    # Word pronunciation from the asset bundle if it's there, in the mixer's
+    # format, or else decoded from its file
+    bundle = get_asset_bundle()
+    if (bundle is not None) and (pron_path in bundle):
+        sound = bundle.get_sound(pron_path)
+        if sound is not None:
+            return sound
+    return pg.mixer.Sound(pron_path)
+
+_prefetcher = AssetPrefetcher(PREFETCH_WORKERS)
+def prefetch_word_assets(words):
+    # Decode images and pronunciations of given words on worker threads;
+    # images are converted to the display's pixel format only when shown.
+    # The asset bundle (if any) is opened here, before workers can need it
+    get_asset_bundle()
+    loaders = {}
+    for word in words:
+        img_path = get_word_img_path(word)
+        if (img_path is not None) and (img_path not in _word_images):
+            loaders[('img', img_path)] = (
+                lambda img_path=img_path: decode_word_image(img_path)
+            )
+        pron_path = get_word_pron_path(word)
+        if (pron_path is not None) and (pron_path not in get_audio()):
+            loaders[('pron', pron_path)] = (
+                lambda pron_path=pron_path: decode_word_pron(pron_path)
+            )
+    _prefetcher.prefetch(loaders)
+
+_word_images = LRUCache(WORD_IMG_CACHE_SIZE)
+def load_word_image(img_path):
+    # Return decoded image, or None if it can't be loaded; missing images are
+    # cached too, so that a failed load isn't retried on every frame
+    word_img = _word_images.get(img_path, False)
+    if word_img is not False:
+        return word_img
+    try:
+        word_img = _prefetcher.take(
+            ('img', img_path), lambda: decode_word_image(img_path)
+        ).convert_alpha()
+    except Exception as e:
+        print(f'{e.__class__.__name__}: image at {img_path}.')
+        word_img = None
+    _word_images.put(img_path, word_img)
+    return word_img
+
+def is_lurnt_result(result, passes_count, schedule, lurnt_passes,
+                    lurnt_interval):
+    # Whether given result makes a card 'lurnt', given its total passes and
+    # review schedule before it; see LURNT_PASSES and LURNT_INTERVAL_DAYS
+    if result != 'pass':
+        return False
+    if passes_count + 1 >= lurnt_passes:
+        return True
+    if lurnt_interval is None:
+        return False
+    next_schedule = review(schedule, 'pass', get_timestamp_now())
+    return next_schedule['interval'] >= lurnt_interval
+
 def get_timestamp_now():
     # Get current time and return as a neatly formatted string
     time_now = datetime.now()
@@ -1100,10 +1418,27 @@ def get_timestamp_now():
     _minute = time_now.strftime('%M')
     return f'{_day}.{_month}.{_year} {_hour}:{_minute}'
 
-def terminate_program():
-    QUIT_SFX.play()
-    pg.time.delay(300)  # 0.3s delay to allow SFX to finish playing
-    pg.quit()
+def wait_for_events(timeout=None):
+    # Sleep until there is at least one event (or timeout in ms runs out),
+    # then return it together with any other events already queued
+    if timeout is None:
+        first_event = pg.event.wait()
+    else:
+        first_event = pg.event.wait(max(1, timeout))
+    if first_event.type == pg.NOEVENT:
+        return []
+    return [first_event] + pg.event.get()
+
+def terminate_program(session=None):
+    # Let the storage backend flush any pending writes before quitting
+    if session is not None:
+        session.repository.close()
+    _prefetcher.shutdown()
+    if _app is not None:
+        get_sfx('quit').play()
+        if not HEADLESS:
+            pg.time.delay(300)  # 0.3s delay to allow SFX to finish playing
+        _app.close()
     sys.exit()
 
 def init_slider(start_val, max_val, min_val, unlurnt_card_count):
@@ -1132,72 +1467,161 @@ def init_slider(start_val, max_val, min_val, unlurnt_card_count):
     return slider
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Würd Lürnür')
+    parser.add_argument('order', nargs='?', default='rand',
+                        choices=['rand', 'chron', 'alpha', 'due'],
+                        help='order of cards in the Session')
+    parser.add_argument('--backend', default='csv', choices=['csv', 'sqlite'],
+                        help='storage backend of the card database')
+    parser.add_argument('--low-latency', action='store_true',
+                        help='use a smaller audio buffer, so sounds are '
+                             'heard sooner')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed for shuffling cards with the rand order')
+    parser.add_argument('--lurnt-passes', type=int, default=LURNT_PASSES,
+                        help='total passes after which a card is lürnt')
+    parser.add_argument('--lurnt-interval', type=int,
+                        default=LURNT_INTERVAL_DAYS,
+                        help='review interval (days) after which a card is '
+                             'lürnt, if reached before enough passes')
+    return parser.parse_args()
+
+def open_repository(backend, journal_max_bytes=JOURNAL_MAX_BYTES):
+    # Storage backends are only imported here, as pandas is slow to import
+    from card_repository import CsvCardRepository, SqliteCardRepository
+
+    def open_csv_repository():
+        return CsvCardRepository(DATABASE_PATH, RESULTS_PATH, JOURNAL_PATH,
+                                 journal_max_bytes, DECK_CACHE_DIR)
+    if backend == 'sqlite':
+        # SQLite database is built from the .csv database on first use
+        return SqliteCardRepository(SQLITE_DATABASE_PATH, open_csv_repository)
+    return open_csv_repository()
+
+def select_session_cards(unlurnt_df, order, card_count, rng=None,
+                         due_dates=None):
+    # Determine which cards (rows of the unlurnt cards) the Session will
+    # comprise of and how to order them, without sorting row by row:
+    # 1) rand - random sample drawn by a numpy Generator (default)
+    # 2) chron - order chronologically, i.e. by date added
+    # 3) alpha - order alphabetically (ignoring case)
+    # 4) due - most overdue for review first, given the due dates of cards
+    #    (by card ID) from the card repository; see scheduler.py
+    # Cards added at the same time / with the same word keep database order
+    if order == 'rand':
+        if rng is None:
+            rng = np.random.default_rng()
+        positions = rng.choice(len(unlurnt_df), size=card_count,
+                               replace=False)
+    elif order == 'chron':
+        # Database is already loaded, so pandas is too by this point
+        import pandas as pd
+        added = pd.to_datetime(unlurnt_df['Card Added'],
+                               format=CARD_ADDED_FORMAT, errors='coerce')
+        # Cards with a missing or malformed date (NaT) are sorted last
+        positions = np.argsort(added.to_numpy(), kind='stable')[:card_count]
+    elif order == 'alpha':
+        # Sorting fixed-width strings is much faster than Python objects
+        words = unlurnt_df['Word'].str.lower().to_numpy(dtype=str)
+        positions = np.argsort(words, kind='stable')[:card_count]
+    elif order == 'due':
+        # Cards are queued by position; those never reviewed are due now
+        due_now = get_due_now()
+        due_queue = DueQueue(
+            (due_dates.get(card_id, due_now), position)
+            for position, card_id in enumerate(unlurnt_df['Card ID'])
+        )
+        positions = due_queue.pop_most_due(card_count)
+    else:
+        raise ValueError('Invalid order of cards.')
+    return unlurnt_df.iloc[positions]
+
+
 def main():
-    # Output welcome message to shell; transfer database of cards into df
+    # Open program window; output welcome message to shell; open database
+    # of cards and get all the 'unlurnt' cards
+    args = parse_args()
+    window = init_app(args.low_latency).window
     print('\n'*25 + '*'*68 + '\n' + ' '*28 + 'Würd Lürnür' + '\n' + '*'*68)
-    with open('cards.csv', 'r') as f:
-        full_df = pd.read_csv(f)
-
-    # Get indices for all the 'unlurnt' words in the dataframe
-    unlurnt_indices = [i for i, row in full_df.iterrows()
-                       if row['Lurnt'] != 'yes']
-    if len(unlurnt_indices) == 0:
+    repository = open_repository(args.backend)
+    unlurnt_df = repository.unlurnt_cards()
+    if len(unlurnt_df) == 0:
         print('Congratulations! All words in database are lürnt.')
         terminate_program()
 
     slider = init_slider(start_val='max', max_val='max', min_val=1,
-                         unlurnt_card_count=(len(unlurnt_indices)))
+                         unlurnt_card_count=(len(unlurnt_df)))
+    save_font_index()  # Fonts of the welcome screen's text are resolved
     on_slider_screen = True
     start_session = False
     new_session_init = False
 
+    drawn_state = None  # Visual state of what is currently on screen
+    animating = False  # Whether frame timer is running
+
     # MAIN GAME LOOP
     while True:
-        WINDOW.blit(BRICKS_BACKGROUND, (0,0))
         if start_session:
             on_slider_screen = False
         if on_slider_screen:
-            slider.welcome_text.draw(faded_background=True)
-            slider.wurd_lurnur_text.draw(faded_background=True)
-            slider.how_many_text.draw(faded_background=True)
-            slider.start_text.draw(button=True)
             if slider.hit:
                 slider.move()
-            slider.draw()
+            visual_state = slider.get_visual_state()
         else:
             if not new_session_init:
-                # Determine which cards (dataframe indices) session will
-                # comprise of and how to order them; option to pass additional
-                # attribute in to module upon execution:
-                # 1) rand - shuffle cards using random.sample (default)
-                # 2) chron - order chronologically, i.e. by date added
-                # 3) alpha - order alphabetically
-                order_cards = sys.argv[1] if len(sys.argv)-1 == 1 else 'rand'
-                if order_cards == 'rand':
-                    session_indices = sample(unlurnt_indices, int(slider.val))
-                    df = full_df.iloc[session_indices]
-                elif order_cards == 'chron':
-                    session_indices = unlurnt_indices[:int(slider.val)]
-                    df = full_df.iloc[session_indices]
-                else:  # alpha: isolate all unlurnt rows before alphabetizing
-                    df = full_df.iloc[unlurnt_indices]
-                    df = df.loc[df['Word'].str.lower().sort_values().index]
-                    df = df.iloc[:int(slider.val)]
-                session = Session(df, full_df)
-                NEW_SESSION_SFX.play()
+                # Order of cards can be passed in to module upon execution
+                # (see select_session_cards)
+                due_dates = (repository.due_dates() if args.order == 'due'
+                             else None)
+                selected_df = select_session_cards(
+                    unlurnt_df, args.order, int(slider.val),
+                    np.random.default_rng(args.seed), due_dates
+                )
+                # Only the cards selected are read from the database in full
+                session_df = repository.fetch_cards(selected_df['Card ID'])
+                session = Session(session_df, repository, args.lurnt_passes,
+                                  args.lurnt_interval)
+                get_sfx('new_session').play()
                 new_session_init = True
 
-            card = session.cards[session.current_card_index]
-            session.draw_card_screen(card)
-
-            if session.showing_stats:
-                session.show_stats()
-
-        event = pg.event.get()
+            card = session.current_card
+            visual_state = session.get_visual_state(card)
+
+        # Only redraw the screen when something visible has changed, and only
+        # push the changed areas of it to the display
+        if visual_state != drawn_state:
+            if on_slider_screen:
+                window.blit(get_image('bricks_background'), (0,0))
+                slider.welcome_text.draw(faded_background=True)
+                slider.wurd_lurnur_text.draw(faded_background=True)
+                slider.how_many_text.draw(faded_background=True)
+                slider.start_text.draw(button=True)
+                slider.draw()
+                dirty_rects = slider.get_dirty_rects(drawn_state, visual_state)
+            else:
+                session.draw_card_screen(card)
+                if session.showing_stats:
+                    session.show_stats()
+                dirty_rects = session.get_dirty_rects(drawn_state,
+                                                      visual_state)
+            pg.display.update(dirty_rects)
+            drawn_state = visual_state
+
+        # Only keep waking up at a constant frame rate while animating
+        if (on_slider_screen and slider.hit) != animating:
+            animating = not animating
+            pg.time.set_timer(FRAME_TIMER_EVENT,
+                              FRAME_TIMER_MS if animating else 0)
+
+        event = wait_for_events()
         for e in event:
+            if e.type == pg.VIDEOEXPOSE:
+                drawn_state = None  # Window uncovered; redraw all of it
             if e.type == pg.QUIT:
                 if not on_slider_screen:
                     session.update_database()
+                    terminate_program(session)
                 terminate_program()
             # MOUSE EVENTS
             if (e.type == pg.MOUSEBUTTONDOWN) and on_slider_screen:
@@ -1214,7 +1638,7 @@ def main():
                     # On card screen when showing stats, User can exit stats
                     # by clicking 'awesome' button or outside of stats frame
                     session.showing_stats = False
-                    POP_SFX.play()
+                    get_sfx('pop').play()
 
             elif (e.type == pg.MOUSEBUTTONDOWN) and not session.showing_stats:
                 # On card screen when not showing stats, many things clickable
@@ -1248,17 +1672,17 @@ def main():
                         session.text['show_hide_cxt'].rect.collidepoint(e.pos)
                     ):
                     card.show_context = not card.show_context
-                    APPEAR_SFX.play()
+                    get_sfx('appear').play()
                 elif session.rects['defi_frame'].collidepoint(e.pos):
                     card.show_definition = not card.show_definition
-                    APPEAR_SFX.play()
+                    get_sfx('appear').play()
                 elif session.text['show_hide_def'].rect.collidepoint(e.pos):
                     card.show_definition = not card.show_definition
                     card.show_image = card.show_definition
-                    APPEAR_SFX.play()
+                    get_sfx('appear').play()
                 elif session.rects['img_frame'].collidepoint(e.pos):
                     card.show_image = not card.show_image
-                    APPEAR_SFX.play()
+                    get_sfx('appear').play()
 
                 # 4) Pronounce icon: play pronunciation track for that word
                 elif session.pronounce_icon_rect.collidepoint(e.pos):
@@ -1267,10 +1691,10 @@ def main():
                 # 5) Session Stats and Quit buttons
                 elif session.text['session_stats'].rect.collidepoint(e.pos):
                     session.showing_stats = True
-                    POP_SFX.play()
+                    get_sfx('pop').play()
                 elif session.text['quit'].rect.collidepoint(e.pos):
                     session.update_database()
-                    terminate_program()
+                    terminate_program(session)
 
             # Mouse button released - deactivate slider button
             elif (e.type == pg.MOUSEBUTTONUP) and on_slider_screen:
@@ -1281,15 +1705,16 @@ def main():
                 if (e.key == pg.K_q) or (e.key == pg.K_w):
                     if not on_slider_screen:
                         session.update_database()
+                        terminate_program(session)
                     terminate_program()
                 # Keyboard controls ...while on slider screen
                 if on_slider_screen:
                     if e.key == pg.K_LEFT:
                         slider.move(-1)
-                        TOGGLE_SFX.play()
+                        get_sfx('toggle').play()
                     if e.key == pg.K_RIGHT:
                         slider.move(1)
-                        TOGGLE_SFX.play()
+                        get_sfx('toggle').play()
                     if e.key == pg.K_RETURN:
                         on_slider_screen = False
                 # ...while on card screen & stats not clicked
@@ -1300,16 +1725,16 @@ def main():
                         card.update_result(new_result)
                     if e.key == pg.K_c:
                         card.show_context = not card.show_context
-                        APPEAR_SFX.play()
+                        get_sfx('appear').play()
                     if e.key == pg.K_d:
                         card.show_definition = not card.show_definition
                         card.show_image = card.show_definition
-                        APPEAR_SFX.play()
+                        get_sfx('appear').play()
                     if e.key == pg.K_p:
                         card.pronounce()
                     if e.key == pg.K_s:
                         session.showing_stats = True
-                        POP_SFX.play()
+                        get_sfx('pop').play()
                     if e.key == pg.K_LEFT:
                         if session.current_card_index > 0:
                             session.change_card('left')
@@ -1320,9 +1745,8 @@ def main():
                 # stats with any key apart from W and Q (checked earlier)
                 elif not on_slider_screen and session.showing_stats:
                     session.showing_stats = False
-                    POP_SFX.play()
-        pg.display.update()
-        CLOCK.tick(60)  # Update screen at a constant 60 FPS
+                    get_sfx('pop').play()
+        get_app().clock.tick(60)  # Never redraw faster than 60 FPS
 
 if __name__ == "__main__":
     main()